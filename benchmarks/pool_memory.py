@@ -0,0 +1,56 @@
+"""
+Benchmark memory usage and construction time of controller pools.
+
+Usage: PYTHONPATH=. python benchmarks/pool_memory.py [number of gateways]
+"""
+
+# pylint: disable=line-too-long
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from ledcontroller import LedControllerPool
+from ledcontroller.compact import CompactLedControllerPool
+
+
+def gateway_ips(count):
+    """ Generate count unique IPv4 addresses """
+    return ["10.%s.%s.%s" % (i >> 16 & 255, i >> 8 & 255, i & 255) for i in range(count)]
+
+
+def measure_memory(pool_class, ips):
+    """ Return bytes allocated by pool_class constructed with ips """
+    gc.collect()
+    tracemalloc.start()
+    pool = pool_class(ips, group_4="white")
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del pool
+    return allocated
+
+
+def measure_time(pool_class, ips):
+    """ Return seconds taken to construct pool_class with ips """
+    gc.collect()
+    start_time = time.perf_counter()
+    pool_class(ips, group_4="white")
+    return time.perf_counter() - start_time
+
+
+def main():
+    """ Run benchmark """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    ips = gateway_ips(count)
+    print("%s gateways" % count)
+    print("%-26s %14s %12s" % ("pool", "bytes/gateway", "build (ms)"))
+    for pool_class in (LedControllerPool, CompactLedControllerPool):
+        # Construction time is measured separately, as tracemalloc slows down allocations.
+        allocated = measure_memory(pool_class, ips)
+        elapsed = min(measure_time(pool_class, ips) for _ in range(3))
+        print("%-26s %14.1f %12.1f" % (pool_class.__name__, float(allocated) / count, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ Based on the documentation available at http://www.limitlessled.com/dev/ .
 
 # pylint: disable=line-too-long
 
+import functools
 import math
 import socket
 import struct
@@ -20,11 +21,60 @@ import time
 from collections import namedtuple
 from colorsys import rgb_to_hls
 
-__all__ = ["LedController", "LedControllerPool", "RGB"]
+__all__ = ["LedController", "LedControllerPool", "RGB", "SystemClock", "UdpTransport"]
 
 RGB = namedtuple("RGB", "R G B")
 
 
+class SystemClock:
+    """
+    Default clock: wall clock time, monotonic time and real sleeps.
+
+    See ledcontroller.simulation.VirtualClock for a clock that does not sleep.
+    """
+    @classmethod
+    def time(cls):
+        """ Current wall clock time, in seconds """
+        return time.time()
+
+    @classmethod
+    def monotonic(cls):
+        """ Current monotonic time, in seconds """
+        return time.monotonic()
+
+    @classmethod
+    def sleep(cls, seconds):
+        """ Sleep for seconds """
+        time.sleep(seconds)
+
+
+class UdpTransport:  # pylint: disable=too-few-public-methods
+    """
+    Default transport: send each packet as a single UDP datagram.
+
+    See ledcontroller.simulation.MemoryTransport for a transport that records packets instead.
+    """
+    @classmethod
+    def send(cls, packet, address):
+        """ Send packet to address ((ip, port) tuple) """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto(packet, address)
+        sock.close()
+
+
+def traced(method):
+    """ Record a span for each call of LedController method, if tracer is set. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.tracer is None:
+            return method(self, *args, **kwargs)
+        arguments = [repr(arg) for arg in args] + ["%s=%r" % item for item in sorted(kwargs.items())]
+        with self._trace(method.__name__, "command", args=", ".join(arguments)):  # pylint: disable=protected-access
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class LedControllerPool:  # pylint: disable=too-few-public-methods
     """
     Pooling for multiple controllers. Handles proper send pauses between controllers.
@@ -35,6 +85,13 @@ class LedControllerPool:  # pylint: disable=too-few-public-methods
             self.controllers.append(LedController(gateway_ip, **kwargs))
         self.last_command_at = 0
 
+    def __len__(self):
+        return len(self.controllers)
+
+    def __getitem__(self, controller_id):
+        """ Get controller, zero-based """
+        return self.controllers[controller_id]
+
     def execute(self, controller_id, command, *args, **kwargs):
         """
         Execute a single command, and sets sleep times properly.
@@ -78,15 +135,15 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         "brightness_down": (b"\x34", ),
     }
 
-    WHITE_GROUP_X_ON = [(b"\x38", ), (b"\x3d", ), (b"\x37", ), (b"\x32", )]
-    WHITE_GROUP_X_OFF = [(b"\x3b", ), (b"\x33", ), (b"\x3a", ), (b"\x36", )]
-    WHITE_GROUP_X_FULL = [(b"\xb8", ), (b"\xbd", ), (b"\xb7", ), (b"\xb2", )]
-    WHITE_GROUP_X_NIGHTMODE = [(b"\xbb", ), (b"\xb3", ), (b"\xba", ), (b"\xb6", )]
+    WHITE_GROUP_X_ON = ((b"\x38", ), (b"\x3d", ), (b"\x37", ), (b"\x32", ))
+    WHITE_GROUP_X_OFF = ((b"\x3b", ), (b"\x33", ), (b"\x3a", ), (b"\x36", ))
+    WHITE_GROUP_X_FULL = ((b"\xb8", ), (b"\xbd", ), (b"\xb7", ), (b"\xb2", ))
+    WHITE_GROUP_X_NIGHTMODE = ((b"\xbb", ), (b"\xb3", ), (b"\xba", ), (b"\xb6", ))
 
-    RGBW_GROUP_X_ON = [(b"\x45", ), (b"\x47", ), (b"\x49", ), (b"\x4b", )]
-    RGBW_GROUP_X_OFF = [(b"\x46", ), (b"\x48", ), (b"\x4a", ), (b"\x4c", )]
-    RGBW_GROUP_X_TO_WHITE = [(b"\xc5", ), (b"\xc7", ), (b"\xc9", ), (b"\xcb", )]
-    RGBW_GROUP_X_NIGHTMODE = [(b"\xc6", ), (b"\xc8", ), (b"\xca", ), (b"\xcc", )]
+    RGBW_GROUP_X_ON = ((b"\x45", ), (b"\x47", ), (b"\x49", ), (b"\x4b", ))
+    RGBW_GROUP_X_OFF = ((b"\x46", ), (b"\x48", ), (b"\x4a", ), (b"\x4c", ))
+    RGBW_GROUP_X_TO_WHITE = ((b"\xc5", ), (b"\xc7", ), (b"\xc9", ), (b"\xcb", ))
+    RGBW_GROUP_X_NIGHTMODE = ((b"\xc6", ), (b"\xc8", ), (b"\xca", ), (b"\xcc", ))
     RGBW_COMMANDS = {
         "all_on": (b"\x42", ),
         "all_off": (b"\x41", ),
@@ -96,6 +153,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         "disco_slower": (b"\x43", ),
         "all_nightmode": (b"\xc1", ),
         "color_by_int": (b"\x40"),
+        "brightness_by_int": (b"\x4e"),
         "color_to_violet": (b"\x40", b"\x00"),
         "color_to_royal_blue": (b"\x40", b"\x10"),
         "color_to_baby_blue": (b"\x40", b"\x20"),
@@ -120,6 +178,9 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             - port (default 8899): UDP port on wifi gateway. Port is 50000 for gw v1 and v2.
             - pause_between_commands (default 0.1 (in seconds)): how long pause there should be between sending commands to the gateway.
             - group_1, group_2, ...: set bulb type for group. Currently either rgbw (default) and "white" are supported. See also .set_group_type method.
+            - transport (default UdpTransport()): object with .send(packet, (ip, port)) method.
+            - clock (default SystemClock()): object with .time(), .monotonic() and .sleep(seconds) methods.
+            - tracer (default None): ledcontroller.tracing.Tracer for recording command spans.
             """
         self.group = {}
         self.has_white = False
@@ -139,6 +200,9 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         self.pause_between_commands = float(kwargs.get("pause_between_commands", 0.1))
         if self.pause_between_commands < 0:
             raise ValueError("pause_between_commands must be >0")
+        self.transport = kwargs.get("transport") or UdpTransport()
+        self.clock = kwargs.get("clock") or SystemClock()
+        self.tracer = kwargs.get("tracer")
 
     def get_group_type(self, group):
         """ Get bulb type for specified group.
@@ -163,6 +227,12 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         self.has_white = "white" in self.group.values()
         self.has_rgbw = "rgbw" in self.group.values()
 
+    def _trace(self, name, category, **args):
+        """ You shouldn't use this method directly.
+
+            Return span context manager. Only call this if tracer is set. """
+        return self.tracer.span(name, category, "%s:%s" % (self.gateway_ip, self.gateway_port), **args)
+
     def _send_command(self, input_command):
         """ You shouldn't use this method directly.
 
@@ -171,11 +241,34 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             constructor keyword). """
         if input_command is None:
             return None
-        time_since_last_command = time.time() - self.last_command_at
+        time_since_last_command = self.clock.time() - self.last_command_at
         if time_since_last_command < self.pause_between_commands:
             # Wifi gateway requires 100ms pause between commands to function at least somewhat reliably.
-            time.sleep(self.pause_between_commands - time_since_last_command)
-        self.last_command_at = time.time()
+            if self.tracer is None:
+                self.clock.sleep(self.pause_between_commands - time_since_last_command)
+            else:
+                with self._trace("pause", "pacing"):
+                    self.clock.sleep(self.pause_between_commands - time_since_last_command)
+        self.last_command_at = self.clock.time()
+        command = self.encode_command(input_command)
+        self._send_packet(command)
+        return command
+
+    def _send_packet(self, packet):
+        """ You shouldn't use this method directly.
+
+            Send a single, already encoded packet to the gateway without any pauses. """
+        if self.tracer is None:
+            self.transport.send(packet, (self.gateway_ip, self.gateway_port))
+            return
+        with self._trace("send", "packet", packet=packet.hex()):
+            self.transport.send(packet, (self.gateway_ip, self.gateway_port))
+
+    @classmethod
+    def encode_command(cls, input_command):
+        """ Encode command tuple (for example, (b"\\x40", b"\\x10")) to a three byte packet.
+
+            Missing bytes are padded the same way the gateway expects. """
         command = b""
         for item in input_command:
             command = command + item
@@ -183,10 +276,6 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             command = command + b"\x00"
         if len(command) == 2:
             command = command + b"\x55"
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(command, (self.gateway_ip, self.gateway_port))
-        sock.close()
         return command
 
     def _send_to_all_groups(self, **kwargs):
@@ -207,28 +296,40 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         Handles automatically sending command to white or rgbw group.
         """
         retries = kwargs.get("retries", self.repeat_commands)
-        for _ in range(retries):
-            if kwargs.get("send_on", True):
-                self.on(group)
-            if group is None or group == 0:
-                self._send_to_all_groups(**kwargs)
+        for attempt in range(retries):
+            if self.tracer is None:
+                self._send_to_group_once(group, **kwargs)
                 continue
+            with self._trace("attempt %s/%s" % (attempt + 1, retries), "retry", group=group):
+                self._send_to_group_once(group, **kwargs)
 
-            if group < 1 or group > 4:
-                raise AttributeError("Group must be between 1 and 4 (was %s)" % group)
+    def _send_to_group_once(self, group, **kwargs):
+        """ You shouldn't use this method directly.
 
-            if kwargs.get("per_group"):
-                self._send_command(kwargs.get("%s_cmd" % self.get_group_type(group), [None, None, None, None])[group - 1])
-                continue
-            if self.get_group_type(group) == "white":
-                command = self.WHITE_COMMANDS.get(kwargs["command"])
-            elif self.get_group_type(group) == "rgbw":
-                if kwargs["command"] == "color_by_int":
-                    command = (self.RGBW_COMMANDS["color_by_int"], struct.pack("B", kwargs["color"]))
-                else:
-                    command = self.RGBW_COMMANDS.get(kwargs["command"])
-            self._send_command(command)
+        Send a single attempt of _send_to_group.
+        """
+        if kwargs.get("send_on", True):
+            self.on(group)
+        if group is None or group == 0:
+            self._send_to_all_groups(**kwargs)
+            return
+
+        if group < 1 or group > 4:
+            raise AttributeError("Group must be between 1 and 4 (was %s)" % group)
+
+        if kwargs.get("per_group"):
+            self._send_command(kwargs.get("%s_cmd" % self.get_group_type(group), [None, None, None, None])[group - 1])
+            return
+        if self.get_group_type(group) == "white":
+            command = self.WHITE_COMMANDS.get(kwargs["command"])
+        elif self.get_group_type(group) == "rgbw":
+            if kwargs["command"] == "color_by_int":
+                command = (self.RGBW_COMMANDS["color_by_int"], struct.pack("B", kwargs["color"]))
+            else:
+                command = self.RGBW_COMMANDS.get(kwargs["command"])
+        self._send_command(command)
 
+    @traced
     def on(self, group=None):  # pylint: disable=invalid-name
         """ Switch lights on. If group (1-4) is not specified,
             all four groups will be switched on. """
@@ -239,6 +340,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             group, per_group=True, white_cmd=self.WHITE_GROUP_X_ON, rgbw_cmd=self.RGBW_GROUP_X_ON, send_on=False
         )
 
+    @traced
     def off(self, group=None):
         """ Switch lights off. If group (1-4) is not specified,
             all four groups will be switched off. """
@@ -249,6 +351,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             group, per_group=True, send_on=False, rgbw_cmd=self.RGBW_GROUP_X_OFF, white_cmd=self.WHITE_GROUP_X_OFF
         )
 
+    @traced
     def white(self, group=None):
         """ Switch lights on and change color to white.
             If group (1-4) is not specified, all four groups
@@ -258,6 +361,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             return
         self._send_to_group(group, per_group=True, rgbw_cmd=self.RGBW_GROUP_X_TO_WHITE)
 
+    @traced
     def set_color(self, color, group=None):
         """ Switch lights on and change color. Available colors:
 
@@ -304,6 +408,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             self._send_to_group(group, command=color_command)
         return color
 
+    @traced
     def brightness_up(self, group=None):
         """ Adjust white bulb brightness up.
 
@@ -311,6 +416,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         have any effect on the brightness."""
         self._send_to_group(group, command="brightness_up")
 
+    @traced
     def brightness_down(self, group=None):
         """ Adjust white bulb brightness down.
 
@@ -318,6 +424,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         have any effect on the brightness."""
         self._send_to_group(group, command="brightness_down")
 
+    @traced
     def cooler(self, group=None):
         """ Adjust white bulb to cooler color temperature.
 
@@ -325,6 +432,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         have any effect. """
         self._send_to_group(group, command="cooler")
 
+    @traced
     def warmer(self, group=None):
         """ Adjust white bulb to warmer color temperature.
 
@@ -346,6 +454,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
         value = int(2 + ((float(percent) / 100) * 25))
         return percent, value
 
+    @traced
     def set_brightness(self, percent, group=None):
         """ Set brightness.
 
@@ -364,9 +473,10 @@ class LedController:  # pylint: disable=too-many-instance-attributes
                 percent = int(percent * 100)
         percent, value = self.get_brightness_level(percent)
         self.on(group)
-        self._send_command((b"\x4e", struct.pack("B", value)))
+        self._send_command((self.RGBW_COMMANDS["brightness_by_int"], struct.pack("B", value)))
         return percent
 
+    @traced
     def disco(self, group=None):
         """ Start disco mode.
 
@@ -399,14 +509,17 @@ class LedController:  # pylint: disable=too-many-instance-attributes
             (Above list is copied from http://www.limitlessled.com/faqs/how-is-limitlessled-better-than-greenwave-led/)."""
         self._send_to_group(group, command="disco", retries=1)
 
+    @traced
     def disco_faster(self, group=None):
         """ Adjust up the speed of disco mode (if enabled; does not start disco mode). """
         self._send_to_group(group, command="disco_faster", retries=1)
 
+    @traced
     def disco_slower(self, group=None):
         """ Adjust down the speed of disco mode (if enabled; does not start disco mode). """
         self._send_to_group(group, command="disco_slower", retries=1)
 
+    @traced
     def nightmode(self, group=None):
         """ Enable nightmode (very dim white light).
 
@@ -433,6 +546,7 @@ class LedController:  # pylint: disable=too-many-instance-attributes
                 retries=1
             )
 
+    @traced
     def batch_run(self, *commands):
         """ Run batch of commands in sequence.
 
@@ -0,0 +1,208 @@
+"""
+Compact controller pool for very large numbers of gateways.
+
+LedControllerPool creates a full LedController for each gateway. CompactLedControllerPool stores
+per-gateway state in packed arrays instead:
+
+- address: IPv4 address packed to an unsigned int (hostnames are stored separately)
+- port: unsigned short
+- group types: bitmask, bit n is set if group n+1 is white
+- last command time: double
+
+LedController-compatible objects are created on demand, and they read and write state directly
+from the arrays. Command tables are class-level tuples shared by all controllers.
+
+Usage:
+
+from ledcontroller.compact import CompactLedControllerPool
+ledpool = CompactLedControllerPool(["192.168.1.6", ("192.168.1.7", 50000)], group_4="white")
+ledpool.execute(0, "on")
+ledpool.execute(1, "set_color", "red", 1)
+ledpool[1].set_group_type(2, "white")
+"""
+
+# pylint: disable=line-too-long
+
+import socket
+import struct
+from array import array
+
+from ledcontroller import LedController
+
+__all__ = ["CompactLedController", "CompactLedControllerPool"]
+
+ALL_WHITE = 0b1111
+
+
+class CompactLedController(LedController):
+    """
+    LedController backed by CompactLedControllerPool arrays.
+
+    Instances are lightweight, temporary views: all per-gateway state is stored in the pool, and any number of
+    views can be created for the same gateway. Use CompactLedControllerPool[index] to get one.
+
+    Settings shared by the pool (repeat_commands, pause_between_commands, transport, clock and tracer) are
+    copied to each view. Changing them on a view only affects that view: for example,
+    ledpool.controllers[0].repeat_commands = 1 is lost, as the next access creates a new view.
+    """
+
+    # LedController does not use __slots__, so views still have a __dict__. Attributes set by views are stored in slots,
+    # so the __dict__ stays empty.
+    __slots__ = ("pool", "index", "repeat_commands", "pause_between_commands", "transport", "clock", "tracer")
+
+    def __init__(self, pool, index):  # pylint: disable=super-init-not-called
+        self.pool = pool
+        self.index = index
+        self.repeat_commands = pool.repeat_commands
+        self.pause_between_commands = pool.pause_between_commands
+        self.transport = pool.transport
+        self.clock = pool.clock
+        self.tracer = pool.tracer
+
+    @property
+    def gateway_ip(self):
+        """ Gateway IP address or hostname """
+        address = self.pool.addresses[self.index]
+        if address == 0:
+            return self.pool.hostnames[self.index]
+        return socket.inet_ntoa(struct.pack("!I", address))
+
+    @property
+    def gateway_port(self):
+        """ Gateway UDP port """
+        return self.pool.ports[self.index]
+
+    @property
+    def last_command_at(self):
+        """ Timestamp of the last command sent to this gateway """
+        return self.pool.gateway_last_command_at[self.index]
+
+    @last_command_at.setter
+    def last_command_at(self, value):
+        self.pool.gateway_last_command_at[self.index] = value
+
+    @property
+    def group(self):
+        """ Bulb types for groups 1-4, as in LedController """
+        return {group: self.get_group_type(group) for group in range(1, 5)}
+
+    @property
+    def has_white(self):
+        """ True if any of the groups is white """
+        return self.pool.group_types[self.index] != 0
+
+    @property
+    def has_rgbw(self):
+        """ True if any of the groups is rgbw """
+        return self.pool.group_types[self.index] != ALL_WHITE
+
+    def get_group_type(self, group):
+        """ Get bulb type for specified group.
+
+        Group must be int between 1 and 4.
+        """
+        if group < 1 or group > 4:
+            raise KeyError(group)
+        if self.pool.group_types[self.index] & (1 << (group - 1)):
+            return "white"
+        return "rgbw"
+
+    def set_group_type(self, group, bulb_type):
+        """ Set bulb type for specified group.
+
+        Group must be int between 1 and 4.
+
+        Type must be "rgbw" or "white".
+        """
+        if bulb_type not in ("rgbw", "white"):
+            raise AttributeError("Bulb type must be either rgbw or white")
+        if group < 1 or group > 4:
+            raise AttributeError("Group must be between 1 and 4 (was %s)" % group)
+        if bulb_type == "white":
+            self.pool.group_types[self.index] |= 1 << (group - 1)
+        else:
+            self.pool.group_types[self.index] &= ALL_WHITE ^ (1 << (group - 1))
+
+
+class CompactLedControllerPool:  # pylint: disable=too-many-instance-attributes
+    """
+    Pooling for very large numbers of controllers. Same interface as LedControllerPool.
+
+    gateway_ips can contain IP addresses/hostnames, or (IP address/hostname, port) tuples.
+    Other keyword arguments are the same as for LedController, and are shared by all gateways.
+    """
+
+    __slots__ = (
+        "addresses", "ports", "group_types", "gateway_last_command_at", "hostnames", "repeat_commands",
+        "pause_between_commands", "transport", "clock", "tracer", "last_command_at"
+    )
+
+    def __init__(self, gateway_ips, **kwargs):
+        # Parse and validate keyword arguments exactly as LedController does.
+        defaults = LedController("0.0.0.0", **kwargs)
+        self.repeat_commands = defaults.repeat_commands
+        self.pause_between_commands = defaults.pause_between_commands
+        self.transport = defaults.transport
+        self.clock = defaults.clock
+        self.tracer = defaults.tracer
+        group_types = 0
+        for group in range(1, 5):
+            if defaults.get_group_type(group) == "white":
+                group_types |= 1 << (group - 1)
+
+        self.addresses = array("I")
+        self.ports = array("H")
+        self.hostnames = {}
+        for gateway in gateway_ips:
+            if isinstance(gateway, tuple):
+                gateway_ip, port = gateway
+                port = int(port)
+                if port < 1 or port > 65535:
+                    raise ValueError("Port must be 1-65535")
+            else:
+                gateway_ip, port = gateway, defaults.gateway_port
+            try:
+                address = struct.unpack("!I", socket.inet_aton(gateway_ip))[0]
+            except (OSError, socket.error):
+                address = 0
+            if address == 0:
+                self.hostnames[len(self.addresses)] = gateway_ip
+            self.addresses.append(address)
+            self.ports.append(port)
+        self.group_types = array("B", [group_types]) * len(self.addresses)
+        self.gateway_last_command_at = array("d", [0]) * len(self.addresses)
+        self.last_command_at = 0
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __getitem__(self, controller_id):
+        """ Get LedController-compatible object for controller, zero-based """
+        if controller_id < 0:
+            controller_id += len(self.addresses)
+        if controller_id < 0 or controller_id >= len(self.addresses):
+            raise IndexError("controller index out of range")
+        return CompactLedController(self, controller_id)
+
+    @property
+    def controllers(self):
+        """ List of LedController-compatible objects, one for each gateway, as in LedControllerPool.
+
+            A new list of temporary views is created on every access. Prefer ledpool[index] for a single gateway. """
+        return [CompactLedController(self, controller_id) for controller_id in range(len(self.addresses))]
+
+    def execute(self, controller_id, command, *args, **kwargs):
+        """
+        Execute a single command, and sets sleep times properly.
+
+        - controller_id = index of controller, zero-based
+        - command is normal LedController command as a string
+        - *args and **kwargs are passed to command
+
+        For example, .execute(0, "on", 1) sends "on" command to group 1 on controller 0 (first IP passed to constructor).
+        """
+        controller_instance = self[controller_id]
+        controller_instance.last_command_at = self.last_command_at
+        ret_val = getattr(controller_instance, command)(*args, **kwargs)
+        self.last_command_at = controller_instance.last_command_at
+        return ret_val
@@ -0,0 +1,430 @@
+"""
+Custom effects for limitless/milight/easybulb lights.
+
+Effects are plain functions of time. Each effect is called with time in seconds (from the
+beginning of the effect), and returns a dictionary of {group: LightState}. Group None means
+all groups.
+
+Effects are pre-rendered to a Timeline: all packets for every frame are encoded in advance
+and stored in compact arrays. Playback does not need to evaluate effect functions or build
+commands anymore.
+
+Usage:
+
+import ledcontroller
+from ledcontroller import effects
+
+led = ledcontroller.LedController("192.168.1.6")
+timeline = effects.render(effects.rainbow(period=10, groups=(1, 2, 3, 4)), led, duration=10, fps=2)
+player = effects.EffectPlayer()
+player.add(led, timeline)
+player.play(loops=3)
+"""
+
+# pylint: disable=line-too-long
+
+import math
+import random
+import struct
+from array import array
+from collections import OrderedDict, namedtuple
+
+from ledcontroller import RGB, SystemClock, rgb_to_hue
+
+__all__ = ["LightState", "Timeline", "EffectPlayer", "render", "rainbow", "candle", "breathing", "police"]
+
+LightState = namedtuple("LightState", "color brightness")
+LightState.__doc__ = """ State of a single group in a single frame.
+
+    - color: None (off), "white", color keyword (for example "red"), int (0-255) or RGB.
+    - brightness: None (not changed), int (0-100) or float (0.0-1.0).
+
+    White bulbs can only be switched on or off. Brightness is not adjusted for white bulbs.
+    """
+
+# Slot 0 is "all groups", slots 1-4 are groups 1-4.
+SLOTS = 5
+
+
+def _brightness_value(controller, brightness):
+    """ Convert brightness (int 0-100 or float 0.0-1.0) to bulbs internal range, as .set_brightness does """
+    if isinstance(brightness, float):
+        if brightness > 1:
+            brightness = int(brightness)
+        else:
+            brightness = int(brightness * 100)
+    return controller.get_brightness_level(brightness)[1]
+
+
+def _rgbw_color_command(controller, color):
+    """ Get color command for RGBW bulbs. Returns None for white, as white commands differ per group. """
+    if color == "white":
+        return None
+    if isinstance(color, RGB):
+        if color.R == 255 and color.G == 255 and color.B == 255:
+            return None
+        color = rgb_to_hue(*color)
+    if isinstance(color, int):
+        if color < 0 or color > 255:
+            raise AttributeError("Color must be color keyword or 0-255")
+        return (controller.RGBW_COMMANDS["color_by_int"], struct.pack("B", color))
+    color_command = "color_to_%s" % color
+    if color_command not in controller.RGBW_COMMANDS:
+        raise AttributeError("'%s' is not a valid color." % color)
+    return controller.RGBW_COMMANDS[color_command]
+
+
+def _is_off(color):
+    return color is None or (isinstance(color, RGB) and color.R == 0 and color.G == 0 and color.B == 0)
+
+
+def _encode_all_groups(controller, state):
+    """ Get commands for LightState for all groups """
+    commands = []
+    if _is_off(state.color):
+        if controller.has_rgbw:
+            commands.append(controller.RGBW_COMMANDS["all_off"])
+        if controller.has_white:
+            commands.append(controller.WHITE_COMMANDS["all_off"])
+        return commands
+    if controller.has_white:
+        commands.append(controller.WHITE_COMMANDS["all_on"])
+    if controller.has_rgbw:
+        commands.append(controller.RGBW_COMMANDS["all_on"])
+        commands.append(_rgbw_color_command(controller, state.color) or controller.RGBW_COMMANDS["all_white"])
+        if state.brightness is not None:
+            commands.append((
+                controller.RGBW_COMMANDS["brightness_by_int"],
+                struct.pack("B", _brightness_value(controller, state.brightness))
+            ))
+    return commands
+
+
+def _encode_group(controller, group, state):
+    """ Get commands for LightState for a single group (1-4) """
+    if group < 1 or group > 4:
+        raise AttributeError("Group must be between 1 and 4 (was %s)" % group)
+    if controller.get_group_type(group) == "white":
+        if _is_off(state.color):
+            return [controller.WHITE_GROUP_X_OFF[group - 1]]
+        return [controller.WHITE_GROUP_X_ON[group - 1]]
+    if _is_off(state.color):
+        return [controller.RGBW_GROUP_X_OFF[group - 1]]
+    commands = [
+        controller.RGBW_GROUP_X_ON[group - 1],
+        _rgbw_color_command(controller, state.color) or controller.RGBW_GROUP_X_TO_WHITE[group - 1],
+    ]
+    if state.brightness is not None:
+        commands.append((
+            controller.RGBW_COMMANDS["brightness_by_int"], struct.pack("B", _brightness_value(controller, state.brightness))
+        ))
+    return commands
+
+
+def encode_state(controller, group, state):
+    """ Encode LightState for a single group to packets (bytes, three bytes per packet).
+
+        Packets are encoded for group types configured to controller. """
+    if group is None or group == 0:
+        commands = _encode_all_groups(controller, state)
+    else:
+        commands = _encode_group(controller, group, state)
+    return b"".join(controller.encode_command(command) for command in commands)
+
+
+class Timeline:
+    """
+    Pre-rendered effect for a single controller.
+
+    Each unique set of packets for a single group ("chunk") is stored only once:
+
+    - packets: all chunks concatenated
+    - offsets: chunk i is packets[offsets[i]:offsets[i + 1]]. Chunk 0 is always empty.
+    - frames: chunk ids, SLOTS (all groups + groups 1-4) per frame.
+    """
+    def __init__(self, fps, frame_count, packets, offsets, frames):
+        self.fps = float(fps)
+        self.frame_count = frame_count
+        self.packets = packets
+        self.offsets = offsets
+        self.frames = frames
+
+    @property
+    def duration(self):
+        """ Duration of a single loop, in seconds """
+        return self.frame_count / self.fps
+
+    def get_chunk(self, chunk_id):
+        """ Get packets for chunk. """
+        return self.packets[self.offsets[chunk_id]:self.offsets[chunk_id + 1]]
+
+    def get_frame(self, frame):
+        """ Get chunk ids for each slot (all groups, groups 1-4) for a frame. """
+        return self.frames[frame * SLOTS:(frame + 1) * SLOTS]
+
+
+def render(effect, controller, duration, fps=10):
+    """ Pre-render effect to a Timeline.
+
+        - effect is a function taking time in seconds and returning {group: LightState}
+        - controller is used for group types (rgbw/white). Same timeline can be played on any controller with same group types.
+        - duration of a single loop, in seconds
+        - fps: frames per second. Keep in mind that each packet takes pause_between_commands to send.
+    """
+    if fps <= 0:
+        raise ValueError("fps must be >0")
+    frame_count = max(1, int(round(duration * fps)))
+    chunk_ids = {b"": 0}
+    packets = bytearray()
+    offsets = array("I", [0, 0])
+    frames = array("H", [0]) * (frame_count * SLOTS)
+    for frame in range(frame_count):
+        states = effect(frame / float(fps))
+        for group, state in states.items():
+            encoded = encode_state(controller, group, state)
+            if encoded not in chunk_ids:
+                chunk_ids[encoded] = len(offsets) - 1
+                packets.extend(encoded)
+                offsets.append(len(packets))
+            frames[frame * SLOTS + (group or 0)] = chunk_ids[encoded]
+    return Timeline(fps, frame_count, bytes(packets), offsets, frames)
+
+
+class _Track:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """ Playback state of a single timeline. """
+    def __init__(self, controller, timeline):
+        self.controller = controller
+        self.timeline = timeline
+        self.reset()
+
+    def reset(self):
+        """ Reset playback state. Bulbs may have been changed since the previous playback, so everything is sent again. """
+        self.frame = -1
+        self.pending = []
+        self.in_chunk = False
+        self.sent = [0] * SLOTS
+        self.frames_played = 0
+        self.frames_skipped = 0
+        self.packets_sent = 0
+
+    def load(self, frame):
+        """ Replace pending packets with packets for new frame. Packets already received by bulbs are not sent again.
+
+            Frames that were jumped over, or replaced before all packets were sent, are counted as skipped. """
+        self.frames_skipped += frame - self.frame - 1
+        if self.pending:
+            self.frames_skipped += 1
+        self.frame = frame
+        self.pending = []
+        self.in_chunk = False
+        chunks = self.timeline.get_frame(frame % self.timeline.frame_count)
+        for slot, chunk_id in enumerate(chunks):
+            if chunk_id in (0, self.sent[slot]):
+                continue
+            if slot == 0:
+                # All groups are changed, so all other groups must be sent again.
+                self.sent = [0] * SLOTS
+            chunk = self.timeline.get_chunk(chunk_id)
+            for i in range(0, len(chunk), 3):
+                # Slot is marked as sent only after the last packet of the chunk was sent.
+                self.pending.append((chunk[i:i + 3], slot, chunk_id if i + 3 == len(chunk) else None))
+        self.pending.reverse()
+        if not self.pending:
+            self.frames_played += 1
+
+    def update(self, start, now, total_frames):
+        """ Load the current frame, if it was not loaded yet. Returns deadline for the next frame, or None after the last frame. """
+        frame = int((now - start) * self.timeline.fps)
+        if start + (frame + 1) / self.timeline.fps <= now:
+            # Rounding error: the next frame deadline has already passed.
+            frame += 1
+        if self.frame < frame < total_frames:
+            self.load(frame)
+        if self.frame + 1 < total_frames:
+            return start + (self.frame + 1) / self.timeline.fps
+        return None
+
+    def send_next(self):
+        """ Send the next pending packet. Returns slot of the chunk if the chunk was finished, otherwise None. """
+        packet, slot, chunk_id = self.pending.pop()
+        self.controller._send_packet(packet)  # pylint: disable=protected-access
+        self.packets_sent += 1
+        self.in_chunk = chunk_id is None
+        if not self.pending:
+            self.frames_played += 1
+        if chunk_id is None:
+            return None
+        self.sent[slot] = chunk_id
+        return slot
+
+    def invalidate(self, slot):
+        """ Another track changed slot on the same gateway, so packets for it must be sent again. """
+        if slot == 0:
+            self.sent = [0] * SLOTS
+        else:
+            self.sent[0] = 0
+            self.sent[slot] = 0
+
+
+class _Gateway:
+    """ Pacing state shared by all tracks playing on the same gateway (ip, port). """
+    def __init__(self):
+        self.tracks = []
+        self.pause = 0
+        self.next_send_at = 0
+        self.sending = None
+        self.turn = 0
+
+    def add(self, track):
+        """ Add track playing on this gateway. """
+        self.tracks.append(track)
+        self.pause = max(self.pause, track.controller.pause_between_commands)
+
+    def start(self, start):
+        """ Schedule the first packet, respecting pauses for commands sent before the playback. """
+        self.next_send_at = start
+        for track in self.tracks:
+            time_since_last_command = track.controller.clock.time() - track.controller.last_command_at
+            self.next_send_at = max(self.next_send_at, start + self.pause - time_since_last_command)
+
+    def has_pending(self):
+        """ Return True if any track has packets to send. """
+        return any(track.pending for track in self.tracks)
+
+    def send_next(self, now):
+        """ Send the next packet. Each chunk (for example, on + color + brightness) is sent without
+            interruption, as commands apply to the previously selected group. Otherwise tracks take turns. """
+        track = self.sending
+        if track is None or not track.in_chunk:
+            for i in range(len(self.tracks)):
+                track = self.tracks[(self.turn + i) % len(self.tracks)]
+                if track.pending:
+                    break
+            self.turn = (self.tracks.index(track) + 1) % len(self.tracks)
+        slot = track.send_next()
+        self.sending = track
+        if slot is not None:
+            for other in self.tracks:
+                if other is not track:
+                    other.invalidate(slot)
+        self.next_send_at = now + self.pause
+        for other in self.tracks:
+            other.controller.last_command_at = other.controller.clock.time()
+
+
+class EffectPlayer:
+    """
+    Play pre-rendered timelines on one or more controllers at once.
+
+    Frames are scheduled on absolute deadlines (clock.monotonic), so playback does not drift. Each gateway
+    (ip, port) is paced separately with pause_between_commands, also when multiple timelines are played on it. If packets for a frame can't be sent before the next
+    frame is due, the rest of the old frame is dropped and playback continues from the current frame.
+    Skipped frames are counted in stats().
+
+    Usage:
+
+    player = EffectPlayer()
+    player.add(led1, effects.render(effects.police(), led1, duration=1, fps=4))
+    player.add(led2, effects.render(effects.breathing(), led2, duration=4, fps=5))
+    player.play(loops=10)
+
+    Optional keyword arguments:
+        - clock (default SystemClock()): clock used for scheduling frames. See LedController.
+    """
+    def __init__(self, **kwargs):
+        self.tracks = []
+        self.clock = kwargs.get("clock") or SystemClock()
+
+    def add(self, controller, timeline):
+        """ Add timeline to be played on controller. """
+        self.tracks.append(_Track(controller, timeline))
+
+    def stats(self):
+        """ Return list of {"frames_played": int, "frames_skipped": int, "packets_sent": int}, one for each added timeline.
+
+            Stats are for the latest .play(). """
+        return [{
+            "frames_played": track.frames_played,
+            "frames_skipped": track.frames_skipped,
+            "packets_sent": track.packets_sent,
+        } for track in self.tracks]
+
+    def play(self, loops=1):
+        """ Play all added timelines simultaneously. Blocks until playback is finished.
+
+            Each timeline is played loops times. Timelines with different durations finish at different times.
+        """
+        if loops < 1:
+            raise ValueError("loops must be > 0")
+        start = self.clock.monotonic()
+        gateways = OrderedDict()
+        for track in self.tracks:
+            track.reset()
+            gateways.setdefault((track.controller.gateway_ip, track.controller.gateway_port), _Gateway()).add(track)
+        for gateway in gateways.values():
+            gateway.start(start)
+        while True:
+            now = self.clock.monotonic()
+            deadlines = []
+            for track in self.tracks:
+                next_frame_at = track.update(start, now, track.timeline.frame_count * loops)
+                if next_frame_at is not None:
+                    deadlines.append(next_frame_at)
+            for gateway in gateways.values():
+                if gateway.has_pending() and now >= gateway.next_send_at:
+                    gateway.send_next(now)
+                if gateway.has_pending():
+                    deadlines.append(gateway.next_send_at)
+            if not deadlines:
+                return
+            sleep_time = min(deadlines) - self.clock.monotonic()
+            if sleep_time > 0:
+                self.clock.sleep(sleep_time)
+
+
+def rainbow(period=10.0, groups=(None, ), brightness=None):
+    """ Cycle through all colors once per period (seconds).
+
+        Multiple groups are spread evenly over the color wheel. """
+    def effect(t):  # pylint: disable=invalid-name
+        states = {}
+        for i, group in enumerate(groups):
+            hue = int((t / period + float(i) / len(groups)) * 256) % 256
+            states[group] = LightState(hue, brightness)
+        return states
+
+    return effect
+
+
+def candle(groups=(None, ), color=RGB(255, 120, 20), brightness=60, depth=30, rate=8.0, seed=0):  # pylint: disable=too-many-arguments
+    """ Candle flicker: brightness changes randomly around brightness (+-depth/2) rate times per second.
+
+        Flicker is deterministic for the same seed. """
+    def effect(t):  # pylint: disable=invalid-name
+        states = {}
+        step = int(t * rate)
+        for group in groups:
+            flicker = random.Random("%s:%s:%s" % (seed, group, step)).random() - 0.5
+            level = int(min(100, max(0, brightness + flicker * depth)))
+            states[group] = LightState(color, level)
+        return states
+
+    return effect
+
+
+def breathing(period=4.0, color="white", groups=(None, ), low=10, high=100):
+    """ Smoothly fade brightness between low and high (0-100) once per period (seconds). """
+    def effect(t):  # pylint: disable=invalid-name
+        level = low + (high - low) * (1 - math.cos(2 * math.pi * t / period)) / 2
+        return {group: LightState(color, int(round(level))) for group in groups}
+
+    return effect
+
+
+def police(period=1.0, groups=(1, 2, 3, 4), colors=("red", "royal_blue")):
+    """ Alternate two colors across groups: every other group has the first color, and colors swap every half period. """
+    def effect(t):  # pylint: disable=invalid-name
+        phase = int(2 * t / period) % 2
+        return {group: LightState(colors[(i + phase) % 2], 100) for i, group in enumerate(groups)}
+
+    return effect
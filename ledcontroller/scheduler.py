@@ -0,0 +1,559 @@
+"""
+In-process scheduler for timed light routines.
+
+All jobs are kept in a single timer heap. When several actions are due at the same time for
+the same gateway, they are sent as a single paced burst (see LedController.batch_run).
+
+Usage:
+
+import ledcontroller
+from ledcontroller.scheduler import Daily, Scheduler, SunEvent
+
+led = ledcontroller.LedController("192.168.1.6")
+scheduler = Scheduler()
+scheduler.schedule(Daily(7, 0), led, "set_brightness", 10, 1)
+scheduler.schedule(Daily(7, 15), led, "set_brightness", 100, 1)
+scheduler.schedule(SunEvent(60.17, 24.94, "sunset"), led, "on", 2)
+scheduler.schedule(Daily(0, 0), led, "off")
+scheduler.at(time.time() + 60, led, "set_color", "red", 3)
+scheduler.run()
+
+Pools are supported with controller_id keyword:
+
+ledpool = ledcontroller.LedControllerPool(["192.168.1.6", "192.168.1.7"])
+scheduler.schedule(Daily(23, 30), ledpool, "off", controller_id=1)
+"""
+
+# pylint: disable=line-too-long
+
+import copy
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+
+from ledcontroller import LedController, SystemClock
+
+__all__ = ["Daily", "Every", "Job", "Scheduler", "SunEvent"]
+
+LOGGER = logging.getLogger(__name__)
+
+DAY = 86400
+
+# LedController methods that can be scheduled.
+COMMANDS = (
+    "on", "off", "white", "set_color", "brightness_up", "brightness_down", "cooler", "warmer", "set_brightness", "disco",
+    "disco_faster", "disco_slower", "nightmode"
+)
+
+# These commands are sent only once: repeating them would cycle disco modes or blink lights.
+SINGLE_SHOT_COMMANDS = ("disco", "disco_faster", "disco_slower", "nightmode")
+
+
+class Every:  # pylint: disable=too-few-public-methods
+    """
+    Recurring rule: every interval seconds, starting at start (timestamp).
+    """
+    def __init__(self, interval, start):
+        if interval <= 0:
+            raise ValueError("interval must be >0")
+        self.interval = float(interval)
+        self.start = float(start)
+
+    def next_after(self, timestamp):
+        """ Return the first run time after timestamp """
+        if timestamp < self.start:
+            return self.start
+        return self.start + (math.floor((timestamp - self.start) / self.interval) + 1) * self.interval
+
+
+class Daily:  # pylint: disable=too-few-public-methods
+    """
+    Recurring rule: every day at hour:minute:second, local time.
+
+    Optionally, weekdays is a list of days (0 = Monday, 6 = Sunday).
+    """
+    def __init__(self, hour, minute=0, second=0, weekdays=None):
+        if not (0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second <= 59):
+            raise ValueError("Invalid time of day")
+        self.hour = hour
+        self.minute = minute
+        self.second = second
+        self.weekdays = weekdays
+
+    def next_after(self, timestamp):
+        """ Return the first run time after timestamp """
+        local = time.localtime(timestamp)
+        for day in range(8):
+            # mktime normalizes day overflows and daylight saving time.
+            candidate = time.mktime(
+                (local.tm_year, local.tm_mon, local.tm_mday + day, self.hour, self.minute, self.second, 0, 0, -1)
+            )
+            if candidate <= timestamp:
+                continue
+            if self.weekdays is None or time.localtime(candidate).tm_wday in self.weekdays:
+                return candidate
+        raise ValueError("weekdays must contain at least one day between 0 and 6")
+
+
+class SunEvent:  # pylint: disable=too-few-public-methods
+    """
+    Recurring rule: every day at sunrise or sunset, optionally offset by offset seconds.
+
+    - latitude and longitude in degrees (north and east are positive).
+    - event is either "sunrise" or "sunset"
+
+    Days without sunrise or sunset (polar night and midnight sun) are skipped.
+    Calculation is accurate to a few minutes, which is enough for lights.
+    """
+    def __init__(self, latitude, longitude, event="sunrise", offset=0):
+        if event not in ("sunrise", "sunset"):
+            raise AttributeError("Event must be either sunrise or sunset")
+        self.latitude = latitude
+        self.longitude = longitude
+        self.event = event
+        self.offset = offset
+
+    def get_time(self, day_timestamp):
+        """ Return sunrise/sunset timestamp for the UTC day starting at day_timestamp, or None if the sun does not rise or set. """
+        # Based on the sunrise/sunset algorithm from Almanac for Computers (1990).
+        day_of_year = time.gmtime(day_timestamp).tm_yday
+        longitude_hour = self.longitude / 15.0
+        approximate = day_of_year + ((6 if self.event == "sunrise" else 18) - longitude_hour) / 24
+        anomaly = 0.9856 * approximate - 3.289
+        sun_longitude = (
+            anomaly + 1.916 * math.sin(math.radians(anomaly)) + 0.020 * math.sin(math.radians(2 * anomaly)) + 282.634
+        ) % 360
+        right_ascension = math.degrees(math.atan(0.91764 * math.tan(math.radians(sun_longitude)))) % 360
+        right_ascension += math.floor(sun_longitude / 90) * 90 - math.floor(right_ascension / 90) * 90
+        sin_declination = 0.39782 * math.sin(math.radians(sun_longitude))
+        cos_declination = math.cos(math.asin(sin_declination))
+        latitude = math.radians(self.latitude)
+        zenith = math.cos(math.radians(90.833))
+        cos_hour_angle = (zenith - sin_declination * math.sin(latitude)) / (cos_declination * math.cos(latitude))
+        if cos_hour_angle > 1 or cos_hour_angle < -1:
+            return None
+        hour_angle = math.degrees(math.acos(cos_hour_angle))
+        if self.event == "sunrise":
+            hour_angle = 360 - hour_angle
+        local_mean_time = hour_angle / 15 + right_ascension / 15 - 0.06571 * approximate - 6.622
+        universal_time = (local_mean_time - longitude_hour) % 24
+        return day_timestamp + universal_time * 3600 + self.offset
+
+    def next_after(self, timestamp):
+        """ Return the first run time after timestamp """
+        day_timestamp = math.floor(timestamp / DAY) * DAY - DAY
+        for day in range(368):
+            candidate = self.get_time(day_timestamp + day * DAY)
+            if candidate is not None and candidate > timestamp:
+                return candidate
+        raise ValueError("No %s at latitude %s" % (self.event, self.latitude))
+
+
+class Job:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """
+    Scheduled action. Returned by Scheduler.at and Scheduler.schedule.
+    """
+    def __init__(self, when, rule, target, controller_id, command, args):  # pylint: disable=too-many-arguments
+        self.when = when
+        self.rule = rule
+        self.target = target
+        self.controller_id = controller_id
+        self.command = command
+        self.args = args
+        self.cancelled = False
+
+    @property
+    def gateway(self):
+        """ Key identifying the gateway this job sends commands to.
+
+            Controllers with the same IP address and port share the key. Gateways in pools are identified
+            by pool and controller_id, as pools have their own pauses between commands.
+        """
+        if self.controller_id is None:
+            return ("gateway", self.target.gateway_ip, self.target.gateway_port)
+        return ("pool", id(self.target), self.controller_id)
+
+    @property
+    def lane(self):
+        """ Key identifying gateways that share pauses between commands: a single gateway, or all gateways in a pool. """
+        if self.controller_id is None:
+            return self.gateway
+        return ("pool", id(self.target))
+
+    def get_controller(self):
+        """ Return controller for the job """
+        if self.controller_id is None:
+            return self.target
+        return self.target[self.controller_id]
+
+    def cancel(self):
+        """ Cancel job. Recurring jobs are not run anymore. """
+        self.cancelled = True
+
+
+class _RecordedSpan:  # pylint: disable=too-few-public-methods
+    """ Span recorded by _Recorder, in positions of recorded events instead of time. """
+    def __init__(self, recorder, name, category, track, args):  # pylint: disable=too-many-arguments
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.track = track
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = len(self.recorder.events)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = repr(exc_value)
+        self.recorder.spans.append((self.name, self.category, self.track, self.start, len(self.recorder.events), self.args))
+
+
+class _Recorder:
+    """ Clock, transport and tracer collecting packets and spans without sending them or sleeping.
+
+        Spans are timed afterwards with the actual send times (see replay).
+    """
+    def __init__(self, now):
+        self.now = now
+        self.packets = []
+        self.send_times = []
+        # Packet index for each packet, and None for each pause
+        self.events = []
+        self.spans = []
+        self.failed_index = None
+        self.error = None
+
+    def time(self):
+        """ Time when the burst was started """
+        return self.now
+
+    def monotonic(self):
+        """ Time when the burst was started """
+        return self.now
+
+    def sleep(self, seconds):  # pylint: disable=unused-argument
+        """ Pauses are handled when packets are sent """
+        self.events.append(None)
+
+    def send(self, packet, address):  # pylint: disable=unused-argument
+        """ Store packet """
+        self.events.append(len(self.packets))
+        self.packets.append(packet)
+        self.send_times.append(None)
+
+    def span(self, name, category, track, **args):
+        """ Return context manager recording a span (see Tracer.span) """
+        return _RecordedSpan(self, name, category, track, args)
+
+    def replay(self, tracer):
+        """ Record spans to tracer. Each event starts when the previous packet was sent, and packets are sent
+            instantly, so pause spans last until the next packet was sent. Spans starting after the last
+            sent packet are dropped. """
+        starts = []
+        previous = None
+        for event in self.events:
+            if event is not None:
+                if self.send_times[event] is None:
+                    break
+                previous = self.send_times[event]
+            starts.append(previous)
+        if previous is None:
+            return
+        sent = len(starts)
+        starts.append(previous)
+        # Pauses before the first packet start when the first packet was sent.
+        first = next(started_at for started_at in starts if started_at is not None)
+        starts = [first if started_at is None else started_at for started_at in starts]
+        failed_event = self.events.index(self.failed_index) if self.failed_index is not None else None
+        for name, category, track, start, end, args in self.spans:
+            if start >= sent and sent < len(self.events):
+                continue
+            end = min(end, sent)
+            if failed_event is not None and start <= failed_event < end:
+                args = dict(args, error=self.error)
+            tracer.record(name, category, track, starts[start], starts[end] - starts[start], args)
+
+
+class _Lane:  # pylint: disable=too-few-public-methods
+    """ Packets for gateways that share pauses between commands. """
+    def __init__(self, pool):
+        self.pool = pool
+        self.controllers = []
+        self.recorders = []
+        self.packets = deque()
+        self.pause = 0
+        self.last_command_at = pool.last_command_at if pool is not None else 0
+        self.next_send_at = None
+
+    def add(self, controller, recorder):
+        """ Add packets recorded for controller """
+        self.controllers.append(controller)
+        self.recorders.append(recorder)
+        self.pause = max(self.pause, controller.pause_between_commands)
+        self.last_command_at = max(self.last_command_at, controller.last_command_at)
+        self.packets.extend((controller, packet, recorder, index) for index, packet in enumerate(recorder.packets))
+
+
+class Scheduler:  # pylint: disable=too-many-instance-attributes
+    """
+    Run controller commands at absolute times or with recurring rules (Every, Daily, SunEvent).
+
+    Optional keyword arguments:
+        - clock (default SystemClock()): see LedController. Use ledcontroller.simulation.VirtualClock for simulations.
+        - misfire_grace_time (default 60): how many seconds late (for example, after suspend) a job may still run.
+        - misfire (default "skip"): what to do with jobs that are later than misfire_grace_time: "skip" or "run".
+        - max_sleep (default 60): longest single sleep, in seconds. Clock jumps are noticed after at most max_sleep.
+
+    Missed deadlines are handled predictably:
+
+    - A job is never run more than once per tick. Recurring jobs that missed multiple runs are run (or skipped) once,
+      and continue from the next run time after the current time.
+    - If clock jumps backwards, recurring jobs are rescheduled from the current time. One-off jobs keep their time.
+    - Lateness is measured when a tick starts. Jobs that become due while the tick is sending packets are run on the next tick.
+
+    Packets for different gateways are interleaved, so a tick takes about as long as the longest burst for
+    a single gateway. Controllers with the same IP address and port share pauses. Gateways in the same pool
+    share the pool pause (as with LedControllerPool.execute), so commands for all gateways in a pool are sent one by one:
+    with default settings, turning off 1000 gateways in a single pool takes 1000 * 3 * 0.1 seconds.
+    Keep misfire_grace_time longer than that, or use separate controllers instead of a pool.
+
+    Errors are logged. A job that fails (for example, with an invalid color) is skipped, and other jobs for
+    the same gateway are still run. If sending to a gateway fails (for example, the network is unreachable),
+    the rest of its packets are dropped, and other gateways are not affected.
+    """
+    def __init__(self, **kwargs):
+        self.clock = kwargs.get("clock") or SystemClock()
+        self.misfire_grace_time = float(kwargs.get("misfire_grace_time", 60))
+        if self.misfire_grace_time < 0:
+            raise ValueError("misfire_grace_time must be >=0")
+        self.misfire = kwargs.get("misfire", "skip")
+        if self.misfire not in ("skip", "run"):
+            raise AttributeError("misfire must be either skip or run")
+        self.max_sleep = float(kwargs.get("max_sleep", 60))
+        if self.max_sleep <= 0:
+            raise ValueError("max_sleep must be >0")
+        self.heap = []
+        self.counter = 0
+        self.last_tick_at = None
+        self.gateway_last_command_at = {}
+
+    def __len__(self):
+        return len([job for _, _, job in self.heap if not job.cancelled])
+
+    def _push(self, job):
+        # Counter keeps jobs with the same run time in scheduling order.
+        self.counter += 1
+        heapq.heappush(self.heap, (job.when, self.counter, job))
+
+    def _create_job(self, when, rule, target, command, args, controller_id):  # pylint: disable=too-many-arguments
+        if command not in COMMANDS:
+            raise AttributeError("'%s' is not a valid command." % command)
+        if controller_id is None and not isinstance(target, LedController):
+            raise AttributeError("controller_id is required for pools")
+        job = Job(when, rule, target, controller_id, command, args)
+        self._push(job)
+        return job
+
+    def at(self, when, target, command, *args, controller_id=None):  # pylint: disable=invalid-name
+        """ Run command once at when (timestamp).
+
+            - target is LedController, or a pool (with controller_id)
+            - command is LedController method name as a string (see COMMANDS)
+            - *args are passed to command
+
+            For example, .at(time.time() + 10, led, "off", 1)
+        """
+        return self._create_job(when, None, target, command, args, controller_id)
+
+    def schedule(self, rule, target, command, *args, controller_id=None):
+        """ Run command repeatedly, as specified by rule (Every, Daily, SunEvent or any object with .next_after(timestamp)).
+
+            See .at for other arguments.
+        """
+        return self._create_job(rule.next_after(self.clock.time()), rule, target, command, args, controller_id)
+
+    def next_run_at(self):
+        """ Return the next run time, or None if there are no jobs """
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    def _reschedule_recurring(self, now):
+        """ Clock jumped backwards: recalculate recurring jobs from the current time. """
+        entries = self.heap
+        self.heap = []
+        for _, _, job in entries:
+            if job.cancelled:
+                continue
+            if job.rule is not None:
+                job.when = job.rule.next_after(now)
+            self._push(job)
+
+    def run_pending(self):
+        """ Run all jobs that are due. Returns list of jobs that were run.
+
+            Commands for the same gateway are merged to a single burst (in scheduling order).
+            Packets for different gateways are interleaved.
+        """
+        now = self.clock.time()
+        if self.last_tick_at is not None and now < self.last_tick_at:
+            self._reschedule_recurring(now)
+        self.last_tick_at = now
+
+        bursts = OrderedDict()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, job = heapq.heappop(self.heap)
+            if job.cancelled:
+                continue
+            if now - job.when <= self.misfire_grace_time or self.misfire == "run":
+                bursts.setdefault(job.gateway, []).append(job)
+            if job.rule is not None:
+                job.when = job.rule.next_after(now)
+                self._push(job)
+
+        lanes = OrderedDict()
+        ran = []
+        for jobs in bursts.values():
+            if len(jobs) > 1:
+                # Try each job separately first, so that a failing job does not prevent other jobs for the same gateway.
+                jobs = [job for job in jobs if self._try_record_burst([job], now) is not None]
+            recorded = self._try_record_burst(jobs, now) if jobs else None
+            if recorded is None:
+                continue
+            lane_key = jobs[0].lane
+            if lane_key not in lanes:
+                lane = _Lane(jobs[0].target if jobs[0].controller_id is not None else None)
+                lane.last_command_at = max(lane.last_command_at, self.gateway_last_command_at.get(lane_key, 0))
+                lanes[lane_key] = lane
+            for controller, recorder in recorded:
+                lanes[lane_key].add(controller, recorder)
+            ran.extend(jobs)
+        self._send_lanes(lanes)
+        return ran
+
+    @classmethod
+    def _try_record_burst(cls, jobs, now):
+        """ Record burst. If commands fail (for example, with invalid arguments), the error is logged and None is returned. """
+        try:
+            return cls._record_burst(jobs, now)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Scheduled commands %s for %s failed", [job.command for job in jobs], cls._describe(jobs[0]))
+            return None
+
+    @classmethod
+    def _describe(cls, job):
+        """ Return gateway of job for log messages """
+        if job.controller_id is None:
+            return "%s:%s" % (job.target.gateway_ip, job.target.gateway_port)
+        return "controller %s in %r" % (job.controller_id, job.target)
+
+    @classmethod
+    def _record_burst(cls, jobs, now):
+        """ Run commands for a single gateway without sending anything. Returns list of (controller, _Recorder) tuples. """
+        recorded = []
+        for _, controller_jobs in itertools.groupby(jobs, key=lambda job: (id(job.target), job.controller_id)):
+            controller_jobs = list(controller_jobs)
+            controller = controller_jobs[0].get_controller()
+            last_command_at = controller.last_command_at
+            recorder = _Recorder(now)
+            shadow = copy.copy(controller)
+            shadow.transport = recorder
+            shadow.clock = recorder
+            if controller.tracer is not None:
+                shadow.tracer = recorder
+            try:
+                cls._run_commands(shadow, controller_jobs)
+            finally:
+                # Compact pool views store last_command_at to the pool.
+                controller.last_command_at = last_command_at
+            recorded.append((controller, recorder))
+        return recorded
+
+    @classmethod
+    def _run_commands(cls, controller, jobs):
+        """ Run a single command directly, and multiple commands with batch_run. Single-shot commands are always run once. """
+        if len(jobs) == 1:
+            getattr(controller, jobs[0].command)(*jobs[0].args)
+            return
+        batch = []
+        for job in jobs:
+            if job.command in SINGLE_SHOT_COMMANDS:
+                if batch:
+                    controller.batch_run(*batch)
+                    batch = []
+                getattr(controller, job.command)(*job.args)
+            else:
+                batch.append((getattr(controller, job.command), ) + tuple(job.args))
+        if batch:
+            controller.batch_run(*batch)
+
+    def _send_lanes(self, lanes):
+        """ Send packets, interleaving gateways that don't share pauses. """
+        for lane in lanes.values():
+            lane.next_send_at = lane.last_command_at + lane.pause
+        while True:
+            now = self.clock.time()
+            next_send_at = None
+            for lane in lanes.values():
+                if lane.packets and lane.next_send_at <= now:
+                    self._send_next(lane, now)
+                if lane.packets and (next_send_at is None or lane.next_send_at < next_send_at):
+                    next_send_at = lane.next_send_at
+            if next_send_at is None:
+                break
+            sleep_time = next_send_at - self.clock.time()
+            if sleep_time > 0:
+                self.clock.sleep(sleep_time)
+
+        for lane_key, lane in lanes.items():
+            for controller, recorder in zip(lane.controllers, lane.recorders):
+                if controller.tracer is not None:
+                    recorder.replay(controller.tracer)
+            if lane.pool is not None:
+                lane.pool.last_command_at = lane.last_command_at
+                continue
+            for controller in lane.controllers:
+                controller.last_command_at = lane.last_command_at
+            self.gateway_last_command_at[lane_key] = lane.last_command_at
+
+    @classmethod
+    def _send_next(cls, lane, now):
+        """ Send the next packet of lane. If sending fails, the rest of the packets for the same gateway are dropped. """
+        controller, packet, recorder, index = lane.packets.popleft()
+        lane.next_send_at = now + lane.pause
+        lane.last_command_at = now
+        controller.last_command_at = now
+        if controller.tracer is not None:
+            recorder.send_times[index] = controller.tracer.clock.monotonic()
+        try:
+            # Packet spans were recorded with the commands, see _Recorder.replay.
+            controller.transport.send(packet, (controller.gateway_ip, controller.gateway_port))
+        except Exception as error:  # pylint: disable=broad-except
+            recorder.failed_index = index
+            recorder.error = repr(error)
+            address = (controller.gateway_ip, controller.gateway_port)
+            LOGGER.exception("Sending scheduled commands to %s:%s failed", *address)
+            lane.packets = deque(item for item in lane.packets if (item[0].gateway_ip, item[0].gateway_port) != address)
+
+    def run(self, until=None):
+        """ Run jobs until there are no jobs left, or until the clock reaches until (timestamp). Blocks. """
+        while True:
+            next_run_at = self.next_run_at()
+            now = self.clock.time()
+            if next_run_at is None or (until is not None and next_run_at > until):
+                if until is not None and until > now:
+                    self.clock.sleep(min(until - now, self.max_sleep))
+                    self.run_pending()
+                    continue
+                return
+            if next_run_at > now:
+                self.clock.sleep(min(next_run_at - now, self.max_sleep))
+            self.run_pending()
@@ -0,0 +1,80 @@
+"""
+In-memory transport and virtual clock for simulations and tests.
+
+With VirtualClock, sleeping only moves the clock forward, so hours of pacing and
+scheduling can be simulated in milliseconds. MemoryTransport records packets instead of
+sending them.
+
+Usage:
+
+import ledcontroller
+from ledcontroller.simulation import MemoryTransport, VirtualClock
+
+clock = VirtualClock()
+transport = MemoryTransport(clock=clock)
+ledpool = ledcontroller.LedControllerPool(["192.168.1.6", "192.168.1.7"],
+                                         clock=clock, transport=transport)
+ledpool.execute(0, "set_color", "red", 1)
+ledpool.execute(1, "off")
+print(clock.time(), transport.packets)
+"""
+
+# pylint: disable=line-too-long
+
+from collections import namedtuple
+
+__all__ = ["MemoryTransport", "SentPacket", "VirtualClock"]
+
+SentPacket = namedtuple("SentPacket", "time address packet")
+
+# LedController uses last_command_at = 0 for "no commands sent yet", so virtual time must start well after 0,
+# or the first command would wait for a full pause. Small timestamps keep sub-microsecond float precision.
+DEFAULT_START = 86400.0
+
+
+class VirtualClock:
+    """
+    Clock that only advances when .sleep() or .advance() is called.
+
+    The same value is used both for wall clock and for monotonic time. Time starts from start
+    (default DEFAULT_START). Use start > pause_between_commands, as commands sent at time 0 are paced
+    as if a command was sent just before.
+    """
+    def __init__(self, start=DEFAULT_START):
+        self.now = float(start)
+
+    def time(self):
+        """ Current virtual time, in seconds """
+        return self.now
+
+    def monotonic(self):
+        """ Current virtual time, in seconds """
+        return self.now
+
+    def sleep(self, seconds):
+        """ Advance virtual time by seconds, without sleeping """
+        if seconds > 0:
+            self.now += seconds
+
+    def advance(self, seconds):
+        """ Advance virtual time by seconds. Negative values simulate clock jumping backwards. """
+        self.now += seconds
+
+
+class MemoryTransport:
+    """
+    Transport that stores sent packets to .packets (list of SentPacket(time, address, packet) tuples).
+
+    If clock is not specified, time is None.
+    """
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.packets = []
+
+    def send(self, packet, address):
+        """ Store packet """
+        self.packets.append(SentPacket(self.clock.time() if self.clock else None, address, packet))
+
+    def clear(self):
+        """ Remove stored packets """
+        self.packets = []
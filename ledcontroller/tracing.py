@@ -0,0 +1,124 @@
+"""
+Opt-in tracing for LedController commands.
+
+Tracer records spans for each public LedController method call, each retry and each packet
+sent (including pauses between commands). Packets sent by effects.EffectPlayer are recorded
+as packet spans. Commands run by scheduler.Scheduler are recorded when the burst is prepared,
+and timed with the actual send times. Spans are stored in a ring buffer: when capacity is
+reached, the oldest spans are dropped. Traces can be exported to Chrome trace format, and
+opened with chrome://tracing or https://ui.perfetto.dev/ .
+
+Usage:
+
+import ledcontroller
+from ledcontroller.tracing import Tracer
+
+tracer = Tracer()
+ledpool = ledcontroller.LedControllerPool(["192.168.1.6", "192.168.1.7"], tracer=tracer)
+ledpool.execute(0, "set_color", "red", 1)
+ledpool.execute(1, "off")
+tracer.export("trace.json")
+"""
+
+# pylint: disable=line-too-long
+
+import json
+from collections import deque
+
+from ledcontroller import SystemClock
+
+__all__ = ["Tracer"]
+
+
+class _Span:  # pylint: disable=too-few-public-methods
+    """ Context manager recording a single span. Additional arguments can be added to .args before the span ends. """
+    def __init__(self, tracer, name, category, track, args):  # pylint: disable=too-many-arguments
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.track = track
+        self.args = args
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = self.tracer.clock.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = repr(exc_value)
+        duration = self.tracer.clock.monotonic() - self.started_at
+        self.tracer.record(self.name, self.category, self.track, self.started_at, duration, self.args)
+
+
+class Tracer:
+    """
+    Ring buffer for command spans. Pass to LedController, LedControllerPool or CompactLedControllerPool with tracer keyword.
+
+    Optional keyword arguments:
+        - capacity (default 10000): maximum number of stored spans.
+        - clock (default SystemClock()): see LedController. Use the same clock as controllers.
+    """
+    def __init__(self, **kwargs):
+        capacity = int(kwargs.get("capacity", 10000))
+        if capacity < 1:
+            raise ValueError("capacity must be > 0")
+        self.clock = kwargs.get("clock") or SystemClock()
+        self.spans = deque(maxlen=capacity)
+        self.dropped = 0
+
+    def span(self, name, category, track, **args):
+        """ Return context manager recording a span.
+
+            - name: for example, method name
+            - category: "command", "retry", "packet" or "pacing"
+            - track: gateway ("ip:port"). Each gateway is shown as a separate process in trace viewers.
+            - **args are stored with the span
+        """
+        return _Span(self, name, category, track, args)
+
+    def record(self, name, category, track, started_at, duration, args):  # pylint: disable=too-many-arguments
+        """ Store a finished span. started_at and duration are in seconds. """
+        if len(self.spans) == self.spans.maxlen:
+            self.dropped += 1
+        self.spans.append((name, category, track, started_at, duration, args))
+
+    def clear(self):
+        """ Remove all stored spans """
+        self.spans.clear()
+        self.dropped = 0
+
+    def to_chrome_trace(self):
+        """ Return stored spans as Chrome trace (dictionary with "traceEvents" list) """
+        process_ids = {}
+        events = []
+        # Parents end after their children, so they are stored later. Trace viewers expect parents first.
+        ordered = sorted(enumerate(self.spans), key=lambda item: (item[1][3], -item[1][4], -item[0]))
+        for _, (name, category, track, started_at, duration, args) in ordered:
+            if track not in process_ids:
+                process_ids[track] = len(process_ids) + 1
+                events.append({
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": process_ids[track],
+                    "tid": 1,
+                    "args": {
+                        "name": track
+                    }
+                })
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": started_at * 1000000,
+                "dur": duration * 1000000,
+                "pid": process_ids[track],
+                "tid": 1,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": self.dropped}}
+
+    def export(self, filename):
+        """ Write stored spans to filename in Chrome trace format (JSON) """
+        with open(filename, "w", encoding="utf-8") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
@@ -5,10 +5,17 @@ Unit tests for ledcontroller.
 
 # pylint: disable=line-too-long
 
+import json
+import os
+import tempfile
 import time
 import unittest
 
-from ledcontroller import LedController, LedControllerPool
+from ledcontroller import RGB, LedController, LedControllerPool, effects
+from ledcontroller.compact import CompactLedControllerPool
+from ledcontroller.scheduler import Daily, Every, Scheduler, SunEvent
+from ledcontroller.simulation import MemoryTransport, VirtualClock
+from ledcontroller.tracing import Tracer
 
 
 class TestDefaultOptions(unittest.TestCase):
@@ -33,14 +40,22 @@ class TestDefaultOptions(unittest.TestCase):
         with self.assertRaises(ValueError):
             LedController("127.0.0.1", port=0)
 
-    def test_sleep(self):  # pylint: disable=no-self-use
+    def test_sleep(self):
         """ Verify sleeps between subsequent commands """
-        led = LedController("127.0.0.1", pause_between_commands=0.5, repeat_commands=1)
-        start_time = time.time()
+        clock = VirtualClock()
+        transport = MemoryTransport(clock=clock)
+        led = LedController("127.0.0.1", pause_between_commands=0.5, repeat_commands=1, clock=clock, transport=transport)
+        start_time = clock.time()
         led.on()
-        self.assertLess(time.time() - start_time, 0.45)  # there is no sleep for a single command
-        led.off()  # this command needs to wait almost 0.5 seconds
-        self.assertGreater(time.time() - start_time, 0.45)
+        self.assertEqual(clock.time(), start_time)  # there is no sleep for a single command
+        led.off()  # this command needs to wait 0.5 seconds
+        self.assertEqual(clock.time(), start_time + 0.5)
+        self.assertEqual(
+            transport.packets, [
+                (start_time, ("127.0.0.1", 8899), b"\x42\x00\x55"),
+                (start_time + 0.5, ("127.0.0.1", 8899), b"\x41\x00\x55"),
+            ]
+        )
 
     def test_changing_pause(self):
         """ Change pause times """
@@ -215,16 +230,677 @@ class TestConnectionPool(unittest.TestCase):
     Tests commands sent using connection pools (multiple gateways)
     """
     def setUp(self):
-        self.ledpool = LedControllerPool(["127.0.0.1", "127.0.0.2"])
+        self.clock = VirtualClock()
+        self.transport = MemoryTransport(clock=self.clock)
+        self.ledpool = LedControllerPool(["127.0.0.1", "127.0.0.2"], clock=self.clock, transport=self.transport)
 
     def test_set_color_0(self):
         """ Test setting color in controller 0 """
         self.ledpool.execute(0, "set_color", "red", 1)
+        self.assertEqual({packet.address[0] for packet in self.transport.packets}, {"127.0.0.1"})
 
     def test_set_color_1(self):
         """ Test setting color in controller 1 """
         self.ledpool.execute(1, "set_color", "aqua", 3)
+        self.assertEqual({packet.address[0] for packet in self.transport.packets}, {"127.0.0.2"})
 
     def test_on(self):
         """ Test turning lights on """
         self.ledpool.execute(0, "on")
+        self.assertEqual({packet.address[0] for packet in self.transport.packets}, {"127.0.0.1"})
+
+
+class TestCompactConnectionPool(TestConnectionPool):
+    """
+    Tests commands sent using compact connection pools
+    """
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.transport = MemoryTransport(clock=self.clock)
+        self.ledpool = CompactLedControllerPool(["127.0.0.1", ("127.0.0.2", 50000), "localhost"],
+                                                group_4="white",
+                                                clock=self.clock,
+                                                transport=self.transport)
+
+    def test_gateway_settings(self):
+        """ Per-gateway settings are read from arrays """
+        self.assertEqual(len(self.ledpool), 3)
+        self.assertEqual(self.ledpool[0].gateway_ip, "127.0.0.1")
+        self.assertEqual(self.ledpool[0].gateway_port, 8899)
+        self.assertEqual(self.ledpool[1].gateway_ip, "127.0.0.2")
+        self.assertEqual(self.ledpool[1].gateway_port, 50000)
+        self.assertEqual(self.ledpool[-1].gateway_ip, "localhost")
+        self.assertEqual(self.ledpool[0].repeat_commands, 3)
+        self.assertEqual(self.ledpool[0].pause_between_commands, 0.1)
+        self.assertEqual(self.ledpool[0].group, {1: "rgbw", 2: "rgbw", 3: "rgbw", 4: "white"})
+        with self.assertRaises(IndexError):
+            self.ledpool[3]  # pylint: disable=pointless-statement
+        with self.assertRaises(ValueError):
+            CompactLedControllerPool([("127.0.0.1", 0)])
+        with self.assertRaises(ValueError):
+            CompactLedControllerPool(["127.0.0.1"], pause_between_commands=-1)
+
+    def test_views(self):
+        """ Views store pool settings in slots, and changes to views are not stored """
+        controller = self.ledpool[0]
+        controller.set_color("red", 1)
+        self.assertEqual(len(self.transport.packets), 12)
+        self.assertEqual(vars(controller), {})
+        controller.repeat_commands = 1
+        self.assertEqual(self.ledpool[0].repeat_commands, 3)
+        self.assertEqual(self.ledpool.controllers[0].repeat_commands, 3)
+
+    def test_group_types(self):
+        """ Group types are stored separately for each gateway """
+        controller = self.ledpool[1]
+        self.assertTrue(controller.has_rgbw)
+        self.assertTrue(controller.has_white)
+        for group in range(1, 4):
+            controller.set_group_type(group, "white")
+        self.assertFalse(self.ledpool[1].has_rgbw)
+        self.assertEqual(self.ledpool[1].get_group_type(2), "white")
+        self.assertEqual(self.ledpool[0].get_group_type(2), "rgbw")
+        controller.set_group_type(4, "rgbw")
+        self.assertEqual(self.ledpool[1].get_group_type(4), "rgbw")
+        self.assertEqual(self.ledpool[1].get_group_type(3), "white")
+        self.assertRaises(AttributeError, controller.set_group_type, 1, "asdf")
+
+    def test_last_command_at(self):
+        """ Command timestamps are stored to the pool """
+        ledpool = CompactLedControllerPool(["127.0.0.1", "127.0.0.2"],
+                                           pause_between_commands=0,
+                                           repeat_commands=1,
+                                           transport=self.transport)
+        ledpool.execute(1, "off", 2)
+        self.assertGreater(ledpool.last_command_at, 0)
+        self.assertEqual(ledpool.gateway_last_command_at[1], ledpool.last_command_at)
+        self.assertEqual(ledpool.gateway_last_command_at[0], 0)
+
+
+class TestEffects(unittest.TestCase):
+    """
+    Tests for pre-rendered effects and effect playback.
+    """
+    def setUp(self):
+        self.led = LedController("127.0.0.1", pause_between_commands=0, group_2="white")
+
+    def test_encode_state(self):
+        """ Encode single group states to packets """
+        self.assertEqual(effects.encode_state(self.led, 1, effects.LightState(None, None)), b"\x46\x00\x55")
+        self.assertEqual(effects.encode_state(self.led, 1, effects.LightState("red", None)), b"\x45\x00\x55\x40\xb0\x55")
+        self.assertEqual(
+            effects.encode_state(self.led, 1, effects.LightState("white", 100)), b"\x45\x00\x55\xc5\x00\x55\x4e\x1b\x55"
+        )
+        self.assertEqual(effects.encode_state(self.led, 1, effects.LightState(RGB(0, 0, 0), 50)), b"\x46\x00\x55")
+        self.assertEqual(effects.encode_state(self.led, 2, effects.LightState(10, 50)), b"\x3d\x00\x55")
+        self.assertEqual(effects.encode_state(self.led, None, effects.LightState(None, None)), b"\x41\x00\x55\x39\x00\x55")
+        with self.assertRaises(AttributeError):
+            effects.encode_state(self.led, 1, effects.LightState("asdf", None))
+        with self.assertRaises(AttributeError):
+            effects.encode_state(self.led, 5, effects.LightState("red", None))
+
+    def test_render(self):
+        """ Render effects to timelines """
+        for effect in (effects.rainbow(groups=(1, 3)), effects.candle(), effects.breathing(), effects.police()):
+            timeline = effects.render(effect, self.led, duration=2, fps=5)
+            self.assertEqual(timeline.frame_count, 10)
+            self.assertEqual(timeline.duration, 2)
+            self.assertEqual(len(timeline.frames), 10 * effects.SLOTS)
+            self.assertEqual(len(timeline.packets) % 3, 0)
+        with self.assertRaises(ValueError):
+            effects.render(effects.police(), self.led, duration=1, fps=0)
+
+    def test_render_deduplicates_chunks(self):
+        """ Identical group states are stored only once """
+        timeline = effects.render(effects.police(period=1), self.led, duration=4, fps=10)
+        # Two colors on rgbw groups 1, 3 and 4, and "on" for white group 2.
+        self.assertEqual(len(timeline.offsets) - 2, 7)
+        self.assertEqual(timeline.get_frame(0)[1], timeline.get_frame(10)[1])
+        self.assertEqual(timeline.get_frame(0)[2], timeline.get_frame(5)[2])
+
+    def test_play(self):
+        """ Play timelines on multiple controllers """
+        clock = VirtualClock(1000)
+        transport = MemoryTransport(clock=clock)
+        led1 = LedController("127.0.0.1", pause_between_commands=0.001, clock=clock, transport=transport, group_2="white")
+        led2 = LedController("127.0.0.2", pause_between_commands=0.001, clock=clock, transport=transport)
+        player = effects.EffectPlayer(clock=clock)
+        player.add(led1, effects.render(effects.police(period=0.1), led1, duration=0.2, fps=20))
+        player.add(led2, effects.render(effects.breathing(period=0.1), led2, duration=0.1, fps=20))
+        player.play(loops=2)
+        self.assertGreaterEqual(clock.time() - 1000, 0.35)
+        self.assertEqual(
+            player.stats(), [
+                {
+                    "frames_played": 8,
+                    "frames_skipped": 0,
+                    "packets_sent": 46
+                },
+                {
+                    "frames_played": 4,
+                    "frames_skipped": 0,
+                    "packets_sent": 12
+                },
+            ]
+        )
+        self.assertEqual(len(transport.packets), 58)
+        with self.assertRaises(ValueError):
+            player.play(loops=0)
+
+    def test_play_twice(self):
+        """ Everything is sent again on the second playback """
+        clock = VirtualClock(1000)
+        transport = MemoryTransport(clock=clock)
+        led = LedController("127.0.0.1", pause_between_commands=0.001, clock=clock, transport=transport)
+        player = effects.EffectPlayer(clock=clock)
+        player.add(led, effects.render(effects.police(period=0.2), led, duration=0.2, fps=10))
+        player.play()
+        first_packets = [packet.packet for packet in transport.packets]
+        first_stats = player.stats()
+        transport.clear()
+        player.play()
+        self.assertEqual([packet.packet for packet in transport.packets], first_packets)
+        self.assertEqual(player.stats(), first_stats)
+        self.assertEqual(first_stats[0]["frames_played"], 2)
+
+    def test_play_shared_gateway(self):
+        """ Timelines on the same gateway share pauses, and chunks are not interleaved """
+        clock = VirtualClock(1000)
+        transport = MemoryTransport(clock=clock)
+        led = LedController("127.0.0.1", pause_between_commands=0.05, clock=clock, transport=transport)
+        player = effects.EffectPlayer(clock=clock)
+        timelines = [
+            effects.render(effects.police(period=2, groups=(1, 2)), led, duration=2, fps=1),
+            effects.render(effects.candle(groups=(3, 4), rate=1), led, duration=2, fps=1),
+        ]
+        for timeline in timelines:
+            player.add(led, timeline)
+        player.play()
+        for previous, packet in zip(transport.packets, transport.packets[1:]):
+            self.assertGreaterEqual(packet.time - previous.time, 0.05 - 1e-9)
+        # Each chunk (group on, color and brightness) is sent without packets from the other timeline.
+        chunks = set()
+        for timeline in timelines:
+            for frame in range(timeline.frame_count):
+                chunks.update(timeline.get_chunk(chunk_id) for chunk_id in timeline.get_frame(frame))
+        group_on = [led.encode_command(command) for command in led.RGBW_GROUP_X_ON]
+        sent = []
+        for packet in transport.packets:
+            if packet.packet in group_on:
+                sent.append(b"")
+            sent[-1] += packet.packet
+        self.assertEqual(len(sent), 8)
+        for chunk in sent:
+            self.assertIn(chunk, chunks)
+        self.assertEqual(sum(stats["packets_sent"] for stats in player.stats()), len(transport.packets))
+
+    def test_play_all_groups(self):
+        """ Groups are sent again after all groups were changed """
+        clock = VirtualClock(1000)
+        transport = MemoryTransport(clock=clock)
+        led = LedController("127.0.0.1", pause_between_commands=0.01, clock=clock, transport=transport)
+        states = ({
+            1: effects.LightState("red", None)
+        }, {
+            None: effects.LightState("royal_blue", None)
+        }, {
+            1: effects.LightState("red", None)
+        })
+        player = effects.EffectPlayer(clock=clock)
+        player.add(led, effects.render(lambda t: states[int(round(t))], led, duration=3, fps=1))
+        player.play()
+        expected = b"".join(effects.encode_state(led, group, state) for frame in states for group, state in frame.items())
+        self.assertEqual(b"".join(packet.packet for packet in transport.packets), expected)
+        self.assertEqual(player.stats()[0]["frames_played"], 3)
+
+    def test_play_skips_frames(self):
+        """ Frames are skipped when gateway pacing can't keep up """
+        clock = VirtualClock()
+        transport = MemoryTransport(clock=clock)
+        led = LedController("127.0.0.1", pause_between_commands=0.1, clock=clock, transport=transport)
+        player = effects.EffectPlayer(clock=clock)
+        player.add(led, effects.render(effects.rainbow(period=1, groups=(1, 2, 3, 4)), led, duration=0.5, fps=20))
+        player.play()
+        stats = player.stats()[0]
+        self.assertGreater(stats["frames_skipped"], 0)
+        self.assertEqual(stats["frames_played"] + stats["frames_skipped"], 10)
+        self.assertEqual(stats["packets_sent"], len(transport.packets))
+        for previous, packet in zip(transport.packets, transport.packets[1:]):
+            self.assertGreaterEqual(packet.time - previous.time, 0.1 - 1e-9)
+
+
+class TestSimulation(unittest.TestCase):
+    """
+    Tests using in-memory transport and virtual clock.
+    """
+    def setUp(self):
+        self.clock = VirtualClock(1000)
+        self.transport = MemoryTransport(clock=self.clock)
+
+    def test_virtual_clock(self):
+        """ Virtual clock only advances on sleep """
+        self.assertEqual(self.clock.time(), 1000)
+        self.clock.sleep(1.5)
+        self.clock.sleep(-1)
+        self.assertEqual(self.clock.monotonic(), 1001.5)
+        self.clock.advance(-10)
+        self.assertEqual(self.clock.time(), 991.5)
+
+    def test_memory_transport(self):
+        """ Packets are stored with virtual time """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport)
+        led.on(1)
+        self.assertEqual(self.transport.packets[0], (1000, ("127.0.0.1", 8899), b"\x45\x00\x55"))
+        self.assertEqual(MemoryTransport().send(b"\x41\x00\x55", ("127.0.0.1", 8899)), None)
+        self.transport.clear()
+        self.assertEqual(self.transport.packets, [])
+
+    def test_default_start(self):
+        """ The first command is sent without pause with the default start time """
+        clock = VirtualClock()
+        start_time = clock.time()
+        LedController("127.0.0.1", repeat_commands=1, clock=clock, transport=self.transport).on()
+        self.assertEqual(clock.time(), start_time)
+
+    def test_repeated_commands(self):
+        """ Commands are repeated and paced """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport)
+        led.set_color("red", 1)
+        # on (repeated three times) + color, three times
+        self.assertEqual(len(self.transport.packets), 12)
+        self.assertEqual([packet.packet for packet in self.transport.packets[2:4]], [b"\x45\x00\x55", b"\x40\xb0\x55"])
+        self.assertAlmostEqual(self.clock.time(), 1001.1)
+
+    def test_pool(self):
+        """ Pools share pauses between gateways """
+        for pool_class in (LedControllerPool, CompactLedControllerPool):
+            self.transport.clear()
+            ledpool = pool_class(["127.0.0.1", "127.0.0.2"], repeat_commands=1, clock=self.clock, transport=self.transport)
+            ledpool.execute(0, "on")
+            ledpool.execute(1, "off")
+            ledpool.execute(0, "off")
+            self.assertEqual([packet.address[0] for packet in self.transport.packets],
+                             ["127.0.0.1", "127.0.0.2", "127.0.0.1"])
+            for previous, packet in zip(self.transport.packets, self.transport.packets[1:]):
+                self.assertAlmostEqual(packet.time - previous.time, 0.1)
+
+    def test_simulate_day(self):
+        """ A day of hourly commands to multiple gateways is simulated without sleeping """
+        ledpool = LedControllerPool(["127.0.0.%s" % i for i in range(1, 11)], clock=self.clock, transport=self.transport)
+        start_time = time.time()
+        for _ in range(24):
+            for controller_id in range(10):
+                ledpool.execute(controller_id, "set_brightness", 50, 1)
+            self.clock.advance(3600)
+        self.assertLess(time.time() - start_time, 1)
+        self.assertEqual(len(self.transport.packets), 24 * 10 * 4)
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    Tests for scheduler, using virtual clock.
+    """
+    def setUp(self):
+        self.clock = VirtualClock(1000)
+        self.transport = MemoryTransport(clock=self.clock)
+        self.led = LedController("127.0.0.1", repeat_commands=1, clock=self.clock, transport=self.transport)
+        self.scheduler = Scheduler(clock=self.clock)
+
+    def test_every(self):
+        """ Interval rule """
+        rule = Every(10, 100)
+        self.assertEqual(rule.next_after(50), 100)
+        self.assertEqual(rule.next_after(100), 110)
+        self.assertEqual(rule.next_after(125), 130)
+        with self.assertRaises(ValueError):
+            Every(0, 100)
+
+    def test_daily(self):
+        """ Daily rule, in local time """
+        rule = Daily(7, 30)
+        run_at = rule.next_after(time.time())
+        self.assertGreater(run_at, time.time())
+        self.assertLessEqual(run_at - time.time(), 86400 + 3600)
+        self.assertEqual(time.localtime(run_at)[3:6], (7, 30, 0))
+        self.assertGreater(rule.next_after(run_at), run_at)
+        self.assertEqual(time.localtime(Daily(12, weekdays=(6, )).next_after(run_at)).tm_wday, 6)
+        with self.assertRaises(ValueError):
+            Daily(24)
+        with self.assertRaises(ValueError):
+            Daily(12, weekdays=(7, )).next_after(run_at)
+
+    def test_sun_event(self):
+        """ Sunrise and sunset in Helsinki and polar night in Svalbard """
+        midsummer = 1782000000  # 2026-06-21 00:00 UTC
+        sunrise = SunEvent(60.17, 24.94).next_after(midsummer)
+        sunset = SunEvent(60.17, 24.94, "sunset").next_after(midsummer)
+        self.assertAlmostEqual(sunrise, midsummer + 54 * 60, delta=5 * 60)
+        self.assertAlmostEqual(sunset, midsummer + (19 * 60 + 50) * 60, delta=5 * 60)
+        self.assertEqual(SunEvent(60.17, 24.94, "sunset", offset=-1800).next_after(midsummer), sunset - 1800)
+        self.assertGreater(SunEvent(78.2, 15.6).next_after(midsummer + 180 * 86400), midsummer + 230 * 86400)
+        with self.assertRaises(AttributeError):
+            SunEvent(60.17, 24.94, "noon")
+
+    def test_at(self):
+        """ One-off jobs are run once, in order """
+        self.scheduler.at(1010, self.led, "off", 1)
+        self.scheduler.at(1005, self.led, "on", 1)
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.next_run_at(), 1005)
+        self.scheduler.run()
+        self.assertEqual([(packet.time, packet.packet) for packet in self.transport.packets], [(1005, b"\x45\x00\x55"),
+                                                                                               (1010, b"\x46\x00\x55")])
+        self.assertEqual(len(self.scheduler), 0)
+        for command in ("asdf", "RGBW_COMMANDS", "encode_command", "get_group_type", "batch_run", "_send_command"):
+            with self.assertRaises(AttributeError):
+                self.scheduler.at(1020, self.led, command)
+        with self.assertRaises(AttributeError):
+            self.scheduler.at(1020, LedControllerPool(["127.0.0.1"]), "on")
+
+    def test_cancel(self):
+        """ Cancelled jobs are not run """
+        job = self.scheduler.schedule(Every(60, 1060), self.led, "on")
+        self.scheduler.run(until=1200)
+        job.cancel()
+        self.scheduler.run(until=1400)
+        self.assertEqual(len(self.transport.packets), 3)
+        self.assertEqual(self.clock.time(), 1400)
+
+    def test_burst(self):
+        """ Commands due at the same time for the same gateway are sent in a single paced burst """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport)
+        self.scheduler.at(1100, led, "set_color", "red", 1)
+        self.scheduler.at(1100, led, "set_brightness", 50, 1)
+        self.scheduler.run()
+        # (on + color, on + brightness) three times, without nested repeats of .on()
+        self.assertEqual(len(self.transport.packets), 12)
+        self.assertEqual(self.transport.packets[-1].packet, b"\x4e\x0e\x55")
+        self.assertAlmostEqual(self.clock.time(), 1101.1)
+
+    def test_pool(self):
+        """ Jobs for pools keep pool-wide pauses """
+        for pool_class in (LedControllerPool, CompactLedControllerPool):
+            self.transport.clear()
+            ledpool = pool_class(["127.0.0.1", "127.0.0.2"], repeat_commands=1, clock=self.clock, transport=self.transport)
+            when = self.clock.time() + 10
+            self.scheduler.at(when, ledpool, "on", 1, controller_id=0)
+            self.scheduler.at(when, ledpool, "off", 2, controller_id=1)
+            self.scheduler.at(when, ledpool, "off", 3, controller_id=0)
+            self.assertEqual(len(self.scheduler.run_pending()), 0)
+            self.clock.advance(10)
+            self.assertEqual(len(self.scheduler.run_pending()), 3)
+            self.assertEqual([packet.address[0] for packet in self.transport.packets],
+                             ["127.0.0.1", "127.0.0.1", "127.0.0.2"])
+            for previous, packet in zip(self.transport.packets, self.transport.packets[1:]):
+                self.assertAlmostEqual(packet.time - previous.time, 0.1)
+
+    def test_single_shot(self):
+        """ Disco and nightmode are sent once, also in bursts """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport)
+        self.scheduler.at(1010, led, "disco")
+        self.scheduler.at(1020, led, "nightmode")
+        self.scheduler.at(1030, led, "disco_faster")
+        self.scheduler.at(1030, led, "off", 1)
+        self.scheduler.at(1030, led, "disco_slower")
+        self.scheduler.run()
+        # Same packets as when calling the methods directly
+        transport = MemoryTransport()
+        reference = LedController("127.0.0.1", pause_between_commands=0, transport=transport)
+        reference.disco()
+        reference.nightmode()
+        reference.disco_faster()
+        reference.batch_run((reference.off, 1))
+        reference.disco_slower()
+        packets = [packet.packet for packet in self.transport.packets]
+        self.assertEqual(packets, [packet.packet for packet in transport.packets])
+        for command in (b"\x4d", b"\xc1", b"\x44", b"\x43"):
+            self.assertEqual(packets.count(command + b"\x00\x55"), 1)
+
+    def test_same_gateway(self):
+        """ Controllers for the same gateway share bursts and pauses """
+        led1 = LedController("127.0.0.1", repeat_commands=1, clock=self.clock, transport=self.transport)
+        led2 = LedController("127.0.0.1", repeat_commands=1, clock=self.clock, transport=self.transport)
+        self.scheduler.at(1010, led1, "on", 1)
+        self.scheduler.at(1010, led2, "off", 1)
+        self.scheduler.at(1010, led1, "off", 2)
+        self.scheduler.run()
+        self.assertEqual([(packet.time, packet.packet) for packet in self.transport.packets], [(1010, b"\x45\x00\x55"),
+                                                                                               (1010.1, b"\x46\x00\x55"),
+                                                                                               (1010.2, b"\x48\x00\x55")])
+        self.scheduler.at(1010.25, led2, "on", 3)
+        self.scheduler.run()
+        self.assertAlmostEqual(self.transport.packets[-1].time, 1010.3)
+
+    def test_interleave(self):
+        """ Packets for different gateways are interleaved """
+        leds = [LedController("127.0.0.%s" % i, clock=self.clock, transport=self.transport) for i in range(1, 4)]
+        for led in leds:
+            self.scheduler.at(1010, led, "off")
+        self.scheduler.run()
+        self.assertEqual(len(self.transport.packets), 9)
+        self.assertEqual([packet.time for packet in self.transport.packets[:3]], [1010] * 3)
+        self.assertEqual([packet.address[0] for packet in self.transport.packets[:3]],
+                         ["127.0.0.1", "127.0.0.2", "127.0.0.3"])
+        self.assertAlmostEqual(self.clock.time(), 1010.2)
+
+    def test_errors(self):
+        """ Failing jobs and gateways are logged, and do not affect other jobs or gateways """
+        class FailingTransport:  # pylint: disable=too-few-public-methods
+            """ Raises for 127.0.0.2 """
+            def __init__(self, transport):
+                self.transport = transport
+
+            def send(self, packet, address):
+                """ Send or raise """
+                if address[0] == "127.0.0.2":
+                    raise OSError("Network is unreachable")
+                self.transport.send(packet, address)
+
+        transport = FailingTransport(self.transport)
+        leds = [
+            LedController("127.0.0.%s" % i, repeat_commands=1, clock=self.clock, transport=transport) for i in range(1, 4)
+        ]
+        for led in leds:
+            self.scheduler.at(1010, led, "on", 1)
+            self.scheduler.schedule(Every(60, 1010), led, "set_color", "asdf", 1)
+            self.scheduler.at(1010, led, "off", 2)
+        self.clock.advance(10)
+        with self.assertLogs("ledcontroller.scheduler", "ERROR") as logs:
+            self.assertEqual([job.command for job in self.scheduler.run_pending()], ["on", "off"] * 3)
+        self.assertEqual(len(logs.records), 4)
+        self.assertEqual([packet.address[0] for packet in self.transport.packets],
+                         ["127.0.0.1", "127.0.0.3", "127.0.0.1", "127.0.0.3"])
+        self.assertEqual([packet.packet for packet in self.transport.packets[::2]], [b"\x45\x00\x55", b"\x48\x00\x55"])
+
+    def test_misfire(self):
+        """ Late jobs are skipped, and recurring jobs run at most once after suspend """
+        self.scheduler.at(1010, self.led, "on", 1)
+        self.scheduler.schedule(Every(60, 1060), self.led, "on", 2)
+        self.clock.advance(1000)  # suspend
+        self.assertEqual(self.scheduler.run_pending(), [])
+        self.assertEqual(self.scheduler.next_run_at(), 2020)
+        self.assertEqual(len(self.scheduler), 1)
+
+        scheduler = Scheduler(clock=self.clock, misfire="run")
+        scheduler.at(1010, self.led, "on", 1)
+        scheduler.schedule(Every(60, 1060), self.led, "on", 2)
+        self.clock.advance(1000)
+        self.assertEqual(len(scheduler.run_pending()), 2)
+        self.assertEqual(scheduler.next_run_at(), 3040)
+        with self.assertRaises(AttributeError):
+            Scheduler(misfire="asdf")
+
+    def test_clock_jump_backwards(self):
+        """ Recurring jobs are rescheduled when clock jumps backwards """
+        self.scheduler.schedule(Every(60, 1060), self.led, "on", 1)
+        self.scheduler.at(1500, self.led, "off", 1)
+        self.clock.advance(70)
+        self.assertEqual(len(self.scheduler.run_pending()), 1)
+        self.assertEqual(self.scheduler.next_run_at(), 1120)
+        self.clock.advance(-3600)
+        self.scheduler.run_pending()
+        self.assertEqual(self.scheduler.next_run_at(), 1060)
+
+    def test_simulate_day(self):
+        """ A day of routines for many gateways is simulated without sleeping """
+        ledpool = CompactLedControllerPool(["127.0.0.%s" % i for i in range(1, 101)],
+                                           clock=self.clock,
+                                           transport=self.transport)
+        for controller_id in range(100):
+            start = 1000 + (controller_id + 1) * 30
+            self.scheduler.schedule(Every(3600, start), ledpool, "set_brightness", 50, 1, controller_id=controller_id)
+            self.scheduler.schedule(Every(3600, start), ledpool, "off", 2, controller_id=controller_id)
+        start_time = time.time()
+        self.scheduler.run(until=1000 + 86400 - 1)
+        self.assertLess(time.time() - start_time, 5)
+        self.assertEqual(self.clock.time(), 1000 + 86400 - 1)
+        self.assertEqual(len(self.transport.packets), 100 * 24 * 3 * 3)
+
+
+class TestTracing(unittest.TestCase):
+    """
+    Tests for command tracing, using virtual clock.
+    """
+    def setUp(self):
+        self.clock = VirtualClock(1000)
+        self.transport = MemoryTransport()
+        self.tracer = Tracer(clock=self.clock)
+
+    def test_spans(self):
+        """ Spans are recorded for commands, retries, implicit on() and packets """
+        led = LedController("127.0.0.1", repeat_commands=2, clock=self.clock, transport=self.transport, tracer=self.tracer)
+        led.set_color("red", 1)
+        spans = list(self.tracer.spans)
+        commands = [(span[0], span[5]["args"]) for span in spans if span[1] == "command"]
+        self.assertEqual(commands[-1], ("set_color", "'red', 1"))
+        self.assertEqual([name for name, _ in commands].count("on"), 2)
+        self.assertEqual(len([span for span in spans if span[1] == "retry"]), 2 + 2 * 2)
+        packets = [span for span in spans if span[1] == "packet"]
+        self.assertEqual(len(packets), len(self.transport.packets))
+        self.assertEqual(packets[-1][5]["packet"], "40b055")
+        pauses = [span for span in spans if span[1] == "pacing"]
+        self.assertEqual(len(pauses), len(packets) - 1)
+        self.assertAlmostEqual(pauses[0][4], 0.1)
+        self.assertEqual({span[2] for span in spans}, {"127.0.0.1:8899"})
+        self.assertEqual(spans[-1][3], 1000)
+        self.assertAlmostEqual(spans[-1][4], 0.1 * (len(packets) - 1))
+
+    def test_keyword_arguments(self):
+        """ Keyword arguments are stored to command spans """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport, tracer=self.tracer)
+        led.set_color(color="red", group=1)
+        self.assertEqual(self.tracer.spans[-1][5]["args"], "color='red', group=1")
+
+    def test_disabled(self):
+        """ Without tracer, no spans are created """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport)
+        led._trace = lambda *args, **kwargs: self.fail("Span created without tracer")  # pylint: disable=protected-access
+        led.set_color("red", 1)
+        self.assertEqual(len(self.transport.packets), 12)
+
+    def test_effects_and_scheduler(self):
+        """ Packets sent by effect player and scheduler are traced """
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport, tracer=self.tracer)
+        player = effects.EffectPlayer(clock=self.clock)
+        player.add(led, effects.render(effects.breathing(period=2, groups=(1, )), led, duration=2, fps=2))
+        player.play()
+        scheduler = Scheduler(clock=self.clock)
+        scheduler.at(self.clock.time() + 10, led, "off", 2)
+        scheduler.run()
+        packets = [span[5]["packet"] for span in self.tracer.spans if span[1] == "packet"]
+        self.assertEqual(packets, [packet.packet.hex() for packet in self.transport.packets])
+        self.assertEqual(packets[-1], "480055")
+
+    def test_scheduler(self):
+        """ Scheduled commands record the same spans as direct calls, timed when packets were sent """
+        self.transport = MemoryTransport(clock=self.clock)
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport)
+        led.tracer = Tracer(clock=self.clock)
+        led.set_color("red", 1)
+        expected = sorted((span[0], span[1], span[5].get("args"), span[5].get("packet")) for span in led.tracer.spans)
+
+        led.tracer = self.tracer
+        scheduler = Scheduler(clock=self.clock)
+        scheduler.at(self.clock.time() + 10, led, "set_color", "red", 1)
+        scheduler.run()
+        spans = list(self.tracer.spans)
+        self.assertEqual(sorted((span[0], span[1], span[5].get("args"), span[5].get("packet")) for span in spans), expected)
+        packets = [span for span in spans if span[1] == "packet"]
+        self.assertEqual([span[3] for span in packets], [packet.time for packet in self.transport.packets[12:]])
+        pauses = [span for span in spans if span[1] == "pacing"]
+        self.assertEqual(len(pauses), 11)
+        for pause in pauses:
+            self.assertAlmostEqual(pause[4], 0.1)
+        command = [span for span in spans if span[0] == "set_color"][0]
+        self.assertEqual(command[3], self.transport.packets[12].time)
+        self.assertAlmostEqual(command[4], 1.1)
+
+    def test_scheduler_errors(self):
+        """ Spans for scheduled packets that were not sent are dropped """
+        class FailingTransport:  # pylint: disable=too-few-public-methods
+            """ Raises on the second packet """
+            def __init__(self):
+                self.packets = 0
+
+            def send(self, packet, address):  # pylint: disable=unused-argument
+                """ Raise on the second packet """
+                self.packets += 1
+                if self.packets == 2:
+                    raise OSError("Network is unreachable")
+
+        led = LedController(
+            "127.0.0.1", repeat_commands=1, clock=self.clock, transport=FailingTransport(), tracer=self.tracer
+        )
+        scheduler = Scheduler(clock=self.clock)
+        scheduler.at(self.clock.time() + 10, led, "set_color", "red", 1)
+        with self.assertLogs("ledcontroller.scheduler", "ERROR"):
+            scheduler.run()
+        packets = [span for span in self.tracer.spans if span[1] == "packet"]
+        self.assertEqual(len(packets), 2)
+        self.assertIn("error", packets[1][5])
+        self.assertIn("error", self.tracer.spans[-1][5])
+        self.assertEqual(self.tracer.spans[-1][0], "set_color")
+
+    def test_errors(self):
+        """ Errors are stored to spans """
+        led = LedController("127.0.0.1", transport=self.transport, tracer=self.tracer)
+        with self.assertRaises(AttributeError):
+            led.on(5)
+        self.assertIn("error", self.tracer.spans[-1][5])
+
+    def test_ring_buffer(self):
+        """ Oldest spans are dropped when capacity is reached """
+        tracer = Tracer(capacity=5, clock=self.clock)
+        led = LedController("127.0.0.1", clock=self.clock, transport=self.transport, tracer=tracer)
+        led.off()
+        self.assertEqual(len(tracer.spans), 5)
+        self.assertGreater(tracer.dropped, 0)
+        self.assertEqual(tracer.spans[-1][0], "off")
+        tracer.clear()
+        self.assertEqual((len(tracer.spans), tracer.dropped), (0, 0))
+        with self.assertRaises(ValueError):
+            Tracer(capacity=0)
+
+    def test_chrome_trace(self):
+        """ Export pool traces to Chrome trace format """
+        for pool_class in (LedControllerPool, CompactLedControllerPool):
+            self.tracer.clear()
+            ledpool = pool_class(["127.0.0.1", "127.0.0.2"], clock=self.clock, transport=self.transport, tracer=self.tracer)
+            ledpool.execute(0, "set_brightness", 50, 1)
+            ledpool.execute(1, "off")
+            trace = self.tracer.to_chrome_trace()
+            processes = [event["args"]["name"] for event in trace["traceEvents"] if event["ph"] == "M"]
+            self.assertEqual(processes, ["127.0.0.1:8899", "127.0.0.2:8899"])
+            spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+            self.assertEqual(len(spans), len(self.tracer.spans))
+            self.assertEqual(spans[0]["name"], "set_brightness")
+            self.assertEqual(spans[-1]["name"], "send")
+            self.assertEqual(spans[-1]["pid"], 2)
+            self.assertGreater(spans[-1]["ts"], spans[0]["ts"])
+            self.assertGreater(spans[0]["dur"], 0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "trace.json")
+            self.tracer.export(filename)
+            with open(filename, encoding="utf-8") as trace_file:
+                self.assertEqual(json.load(trace_file), json.loads(json.dumps(self.tracer.to_chrome_trace())))